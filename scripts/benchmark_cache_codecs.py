@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+import argparse
+import gzip
+import io
+import os
+import os.path
+import pickle
+import time
+
+import pandas
+import tabulate
+
+from jule.cache_codecs import CODECS, read_value, write_value
+from jule.diff import ADDED, CHANGED, REMOVED, diff_containers
+from jule.plugin import get_default_plugin_class_name, load_from_module
+from jule.state import try_load
+
+
+def write_legacy(f, value):
+    # how values were written before the codecs
+    with gzip.GzipFile(fileobj=f, mode='wb') as gzip_file:
+        pickle.dump(value, gzip_file)
+
+
+def read_legacy(f):
+    with gzip.GzipFile(fileobj=f, mode='rb') as gzip_file:
+        return pickle.load(gzip_file)
+
+
+def get_writers():
+    writers = {'legacy (gzip 9)': (write_legacy, read_legacy)}
+    for name, codec in CODECS.items():
+        writers[name] = (
+            lambda f, value, codec=codec: write_value(f, value, codec),
+            lambda f: read_value(f)[0],
+        )
+    return writers
+
+
+def replicate_row(row, idx: int):
+    if idx == 0:
+        return row
+    return {
+        key: '%s #%d' % (value, idx) if isinstance(value, str) else value
+        for key, value in row.items()
+    }
+
+
+def load_payloads(data_dir: str, plugin_module: str, scale: int):
+    plugin = load_from_module(plugin_module)
+
+    containers = []
+    for file_name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, file_name)
+        container = try_load(path, load_data=False)
+        if container is not None:
+            containers.append((container.metadata.timestamp, path))
+    paths = [path for _, path in sorted(containers)]
+
+    if len(paths) < 2:
+        raise Exception('at least two snapshots are required')
+
+    diffs = [
+        diff_containers(plugin.property_extractor_class, path, baseline_path)
+        for baseline_path, path in zip(paths, paths[1:])
+    ]
+
+    # small samples are replicated to get closer to the real sizes, values
+    # are made unique, so that pickle does not dedupe them
+    diff = {
+        action: [
+            replicate_row(row, idx)
+            for idx in range(scale)
+            for diff in diffs
+            for row in diff[action]
+        ]
+        for action in diffs[0]
+    }
+
+    timeline_frame = pandas.DataFrame.from_records(
+        [dict(row, action='added') for row in diff[ADDED]] +
+        [dict(row, action='removed') for row in diff[REMOVED]])
+
+    return {
+        'diff result': diff,
+        'changed rows': diff[CHANGED],
+        'timeline frame': timeline_frame,
+    }
+
+
+def benchmark(writers, payloads, repeat: int):
+    rows = []
+    for payload_name, payload in payloads.items():
+        for writer_name, (write, read) in writers.items():
+            # the best of the runs is the least affected by the noise
+            write_seconds = read_seconds = float('inf')
+            for _ in range(repeat):
+                f = io.BytesIO()
+                started_at = time.perf_counter()
+                write(f, payload)
+                write_seconds = min(write_seconds, time.perf_counter() - started_at)
+
+                f.seek(0)
+                started_at = time.perf_counter()
+                read(f)
+                read_seconds = min(read_seconds, time.perf_counter() - started_at)
+
+            rows.append([
+                payload_name, writer_name,
+                '%.1f' % (len(f.getvalue()) / 1024.0),
+                '%.2f' % (write_seconds * 1000),
+                '%.2f' % (read_seconds * 1000),
+            ])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='compares cache value codecs on the diffs of the snapshots')
+    parser.add_argument('--data-dir', type=str, default='sample-data')
+    parser.add_argument('--plugin-module', type=str, default=get_default_plugin_class_name())
+    parser.add_argument('--scale', type=int, default=1, help='replicate diff rows that many times')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.data_dir, args.plugin_module, args.scale)
+    rows = benchmark(get_writers(), payloads, args.repeat)
+
+    print(tabulate.tabulate(
+        rows, headers=['payload', 'codec', 'size (KiB)', 'write (ms)', 'read (ms)']))
+
+
+if __name__ == '__main__':
+    main()
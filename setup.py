@@ -18,9 +18,13 @@ if __name__ == '__main__':
             'textual[syntax]',
             'tabulate',
             'pandas',
-            'pandasql',
         ],
         package_data={
             'jule.data': ['*'],
-        }
+        },
+        entry_points={
+            'console_scripts': [
+                'jule-cache=jule.cache:main',
+            ],
+        },
     )
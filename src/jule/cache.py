@@ -1,12 +1,56 @@
-import gzip
+import argparse
+import collections
+import datetime
 import hashlib
 import logging
+import os
 import os.path
-import pickle
-from typing import Dict, Any
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import coloredlogs
+import pandas
+import tabulate
+
+from jule.cache_codecs import read_value, write_value
+from jule.common import fully_qualified_class_name
 
 LOGGER = logging.getLogger(__name__)
 
+# sub-directory of the cache dir query results are stored at
+QUERY_RESULTS_CACHE_DIR = 'query-results'
+
+# index of the entries kept in the store directory
+INDEX_FILENAME = 'cache-index.sqlite'
+TEMP_FILE_PREFIX = '.tmp-'
+# temporary files left behind by crashed writers are removed after that
+STALE_TEMP_FILE_SECONDS = 3600
+CACHE_KEY_PATTERN = re.compile('[0-9a-f]{64}')
+# access time of the values served from memory is written to the index at
+# most that often, which is precise enough for the eviction order
+TOUCH_INTERVAL_SECONDS = 60
+# quoted SQL literals and identifiers (with the doubled quotes escaped)
+SQL_QUOTED_PATTERN = r"'(?:[^']|'')*'" + '|' + r'"(?:[^"]|"")*"'
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MEMORY_MAX_BYTES = 256 * 1024 * 1024
+
+
+def read_umask() -> int:
+    # umask can only be read by setting it, so it is done once on import
+    # rather than next to the threads creating files
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = read_umask()
+
 
 def calculate_hash(properties: Dict[str, str]) -> str:
     hasher = hashlib.sha256()
@@ -19,29 +63,483 @@ def calculate_hash(properties: Dict[str, str]) -> str:
     return hasher.digest().hex()
 
 
+def get_default_max_bytes() -> Optional[int]:
+    value = os.environ.get('JULE_CACHE_MAX_BYTES')
+    return int(value) if value else DEFAULT_MAX_BYTES
+
+
+def get_default_max_entries() -> Optional[int]:
+    value = os.environ.get('JULE_CACHE_MAX_ENTRIES')
+    return int(value) if value else None
+
+
+def get_default_memory_max_bytes() -> int:
+    return int(os.environ.get('JULE_CACHE_MEMORY_BYTES') or DEFAULT_MEMORY_MAX_BYTES)
+
+
+class MemoryCache:
+    """
+    Least recently used values kept in memory within the budget. Size of
+    the value is estimated by the size of its encoded form. Values are shared by
+    all the readers, so they must not be modified.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.lock = threading.Lock()
+        self.items: Dict[str, Tuple[Any, int]] = collections.OrderedDict()
+        self.total_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, cache_key: str) -> Any:
+        with self.lock:
+            if cache_key not in self.items:
+                self.misses += 1
+                return None
+            self.items.move_to_end(cache_key)
+            self.hits += 1
+            return self.items[cache_key][0]
+
+    def contains(self, cache_key: str) -> bool:
+        with self.lock:
+            return cache_key in self.items
+
+    def set(self, cache_key: str, value: Any, size: int):
+        with self.lock:
+            self._remove(cache_key)
+
+            if size > self.max_bytes:
+                return
+
+            self.items[cache_key] = (value, size)
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def remove(self, cache_key: str):
+        with self.lock:
+            self._remove(cache_key)
+
+    def _remove(self, cache_key: str):
+        if cache_key in self.items:
+            _, size = self.items.pop(cache_key)
+            self.total_bytes -= size
+
+    def get_counters(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.items),
+                'bytes': self.total_bytes,
+            }
+
+
 class CacheStore:
-    def __init__(self, dir_path: str):
+    """
+    Directory of values (see "cache_codecs") keyed by the hash. Size and last access
+    time of every entry are tracked in the SQLite index next to the values,
+    so that least recently used ones are evicted once the store grows over
+    the limits without listing the whole directory. Store has no limits
+    unless they are given, the explorer passes the default ones (see
+    get_default_max_bytes, 2 GiB unless JULE_CACHE_MAX_BYTES is set).
+
+    When memory budget is given, recently used values are kept in memory as
+    well (read-through and write-through), so that value read by several
+    screens is loaded from the disk only once. Values served from memory
+    still get their access time updated in the index (not more often than
+    every TOUCH_INTERVAL_SECONDS), so they are not evicted as unused.
+    """
+
+    def __init__(
+            self, dir_path: str,
+            max_bytes: Optional[int] = None,
+            max_entries: Optional[int] = None,
+            memory_max_bytes: Optional[int] = None):
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
         self.dir_path: str = dir_path
+        self.max_bytes: Optional[int] = max_bytes
+        self.max_entries: Optional[int] = max_entries
+        self.memory: Optional[MemoryCache] = (
+            MemoryCache(memory_max_bytes) if memory_max_bytes else None)
+        self.lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        # key -> time.monotonic() of the last index update
+        self.touched_at: Dict[str, float] = {}
+        # several explorers might share the same cache dir
+        self.connection = sqlite3.connect(
+            os.path.join(dir_path, INDEX_FILENAME), timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.ensure_index()
+
+    def ensure_index(self):
+        with self.lock, self.connection:
+            is_new = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entries'"
+            ).fetchone() is None
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, size INTEGER, accessed_at REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)')
+
+        # values written before the index existed
+        if is_new:
+            self.reindex()
+
+    def reindex(self) -> int:
+        """
+        Brings index in line with the files in the directory, modification
+        time of the files not yet indexed is used as their access time.
+        """
+        rows = []
+        for file_name in os.listdir(self.dir_path):
+            if file_name.startswith(TEMP_FILE_PREFIX):
+                self.remove_stale_temp_file(file_name)
+                continue
+            if not CACHE_KEY_PATTERN.fullmatch(file_name):
+                continue
+            try:
+                stat = os.stat(self.get_path(file_name))
+            except FileNotFoundError:  # evicted concurrently
+                continue
+            rows.append((file_name, stat.st_size, stat.st_mtime))
+
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS present (key TEXT PRIMARY KEY)')
+            self.connection.execute('DELETE FROM present')
+            self.connection.executemany(
+                'INSERT INTO present VALUES (?)', [(key,) for key, _, _ in rows])
+            self.connection.execute('DELETE FROM entries WHERE key NOT IN (SELECT key FROM present)')
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO entries VALUES (?, ?, ?)', rows)
+
+        return len(rows)
+
+    def remove_stale_temp_file(self, file_name: str):
+        path = os.path.join(self.dir_path, file_name)
+        try:
+            if os.stat(path).st_mtime < time.time() - STALE_TEMP_FILE_SECONDS:
+                LOGGER.debug('removing stale temporary file "%s"', path)
+                os.remove(path)
+        except FileNotFoundError:
+            pass
 
     def get_path(self, cache_key: str):
         return os.path.join(self.dir_path, cache_key)
 
+    def contains(self, cache_key: str) -> bool:
+        if self.memory is not None and self.memory.contains(cache_key):
+            return True
+        return os.path.exists(self.get_path(cache_key))
+
+    def touch(self, cache_key: str, size: int):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                (cache_key, size, time.time()))
+            self.touched_at[cache_key] = time.monotonic()
+
+    def touch_throttled(self, cache_key: str):
+        # value is used from memory, but still has to stay on the disk
+        with self.lock:
+            now = time.monotonic()
+            if now - self.touched_at.get(cache_key, -TOUCH_INTERVAL_SECONDS) < TOUCH_INTERVAL_SECONDS:
+                return
+            self.touched_at[cache_key] = now
+            with self.connection:
+                self.connection.execute(
+                    'UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), cache_key))
+
+    def count(self, hit: bool):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
     def get(self, cache_key: str) -> Any:
+        if self.memory is not None:
+            obj = self.memory.get(cache_key)
+            if obj is not None:
+                self.touch_throttled(cache_key)
+                return obj
+
         path = self.get_path(cache_key)
 
         if not os.path.exists(path):
+            self.count(hit=False)
             return None
 
         try:
-            with gzip.GzipFile(path, 'rb') as f:
-                obj = pickle.load(f)
-                return obj
+            with open(path, 'rb') as f:
+                obj, size = read_value(f)
+        except FileNotFoundError:  # evicted concurrently
+            self.count(hit=False)
+            return None
         except Exception as err:
             LOGGER.warning('Cache file "%s" looks corrupted: %s', path, err)
+            self.count(hit=False)
+            self.remove(cache_key)
             return None
 
+        self.count(hit=True)
+        self.touch(cache_key, os.path.getsize(path))
+
+        if self.memory is not None:
+            self.memory.set(cache_key, obj, size)
+
+        return obj
+
     def set(self, cache_key: str, value: Any):
         path = self.get_path(cache_key)
 
-        with gzip.GzipFile(path, 'wb') as f:
-            pickle.dump(value, f)
+        # readers never see partially written value, even when writer
+        # crashes or two of them write the same key concurrently
+        fd, temp_path = tempfile.mkstemp(dir=self.dir_path, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                size = write_value(f, value)
+            # temporary file is private, value gets the usual permissions
+            os.chmod(temp_path, 0o666 & ~UMASK)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        if self.memory is not None:
+            self.memory.set(cache_key, value, size)
+
+        self.touch(cache_key, os.path.getsize(path))
+        self.evict()
+
+    def get_counters(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            counters = {'disk': {'hits': self.hits, 'misses': self.misses}}
+        if self.memory is not None:
+            counters['memory'] = self.memory.get_counters()
+        return counters
+
+    def remove(self, cache_key: str):
+        if self.memory is not None:
+            self.memory.remove(cache_key)
+        try:
+            os.remove(self.get_path(cache_key))
+        except FileNotFoundError:
+            pass
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM entries WHERE key = ?', (cache_key,))
+            self.touched_at.pop(cache_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            entries, total_bytes, oldest, newest = self.connection.execute(
+                'SELECT count(*), coalesce(sum(size), 0), min(accessed_at), max(accessed_at) '
+                'FROM entries').fetchone()
+        return {
+            'entries': entries,
+            'bytes': total_bytes,
+            'oldest_access': oldest,
+            'newest_access': newest,
+        }
+
+    def evict(
+            self, max_bytes: Optional[int] = None, max_entries: Optional[int] = None,
+            accessed_before: Optional[float] = None) -> int:
+        """
+        Removes least recently used entries until the store fits the limits
+        (limits of the store by default), returns amount of removed entries.
+        """
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        max_entries = max_entries if max_entries is not None else self.max_entries
+
+        if max_bytes is None and max_entries is None and accessed_before is None:
+            return 0
+
+        with self.lock:
+            stats = self.connection.execute(
+                'SELECT count(*), coalesce(sum(size), 0) FROM entries').fetchone()
+            entries, total_bytes = stats
+
+            if ((max_bytes is None or total_bytes <= max_bytes) and
+                    (max_entries is None or entries <= max_entries) and
+                    accessed_before is None):
+                return 0
+
+            evicted = []
+            cursor = self.connection.execute(
+                'SELECT key, size, accessed_at FROM entries ORDER BY accessed_at')
+            for cache_key, size, accessed_at in cursor:
+                if ((max_bytes is None or total_bytes <= max_bytes) and
+                        (max_entries is None or entries <= max_entries) and
+                        (accessed_before is None or accessed_at >= accessed_before)):
+                    break
+                evicted.append(cache_key)
+                total_bytes -= size
+                entries -= 1
+
+        for cache_key in evicted:
+            LOGGER.debug('evicting cache entry "%s"', cache_key)
+            self.remove(cache_key)
+
+        return len(evicted)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def normalize_query(query: str) -> str:
+    # comments are dropped first, as the line break ending the line comment
+    # is collapsed along with the rest of the whitespace
+    query = re.sub(
+        r'(%s)|--[^\n]*|/\*.*?(?:\*/|$)' % SQL_QUOTED_PATTERN,
+        lambda match: match.group(1) or ' ', query, flags=re.DOTALL)
+    # collapse whitespace outside of the quoted literals and identifiers, so
+    # that re-formatted query still hits the cache
+    parts = re.split(r'(%s)' % SQL_QUOTED_PATTERN, query)
+    for idx in range(0, len(parts), 2):
+        parts[idx] = re.sub(r'\s+', ' ', parts[idx])
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def compact_frame(data_frame: pandas.DataFrame) -> pandas.DataFrame:
+    # repetitive text columns (departments, titles, etc) are way more compact
+    # when stored as categories
+    data_frame = data_frame.copy()
+    for column in data_frame.columns:
+        series = data_frame[column]
+        if series.dtype == object and series.nunique(dropna=True) < len(series) / 2:
+            data_frame[column] = series.astype('category')
+    return data_frame
+
+
+def expand_frame(data_frame: pandas.DataFrame) -> pandas.DataFrame:
+    # cached frame might be shared, so it is not modified in place
+    data_frame = data_frame.copy()
+    for column in data_frame.columns:
+        series = data_frame[column]
+        if isinstance(series.dtype, pandas.CategoricalDtype):
+            series = series.astype(object)
+            data_frame[column] = series.where(series.notna(), None)
+    return data_frame
+
+
+class QueryResultCache:
+    """
+    Caches SQL query results keyed by the snapshot content digest, plugin
+    and the normalized query text. Least recently used results are evicted
+    once the total size goes over the limit.
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(
+            self, dir_path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+            memory_max_bytes: Optional[int] = None):
+        self.store: CacheStore = CacheStore(
+            dir_path, max_bytes=max_bytes, memory_max_bytes=memory_max_bytes)
+
+    @staticmethod
+    def make_key(snapshot_fingerprint: str, plugin, query: str) -> str:
+        return calculate_hash({
+            'cache_type': 'query-result',
+            'snapshot_fingerprint': snapshot_fingerprint,
+            'plugin': fully_qualified_class_name(type(plugin)),
+            'plugin_version': str(plugin.version),
+            'query': normalize_query(query),
+        })
+
+    def get(self, snapshot_fingerprint: str, plugin, query: str) -> Optional[pandas.DataFrame]:
+        cache_key = self.make_key(snapshot_fingerprint, plugin, query)
+        data_frame = self.store.get(cache_key)
+
+        if data_frame is None:
+            return None
+
+        return expand_frame(data_frame)
+
+    def set(self, snapshot_fingerprint: str, plugin, query: str, data_frame: pandas.DataFrame):
+        cache_key = self.make_key(snapshot_fingerprint, plugin, query)
+        self.store.set(cache_key, compact_frame(data_frame))
+
+
+def get_store_dirs(cache_dir: str):
+    return [cache_dir, os.path.join(cache_dir, QUERY_RESULTS_CACHE_DIR)]
+
+
+def format_size(size: int) -> str:
+    return '%.1f MiB' % (size / 1024.0 / 1024.0)
+
+
+def format_access_time(timestamp: Optional[float]) -> str:
+    if timestamp is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='cache directory maintenance')
+    parser.add_argument('--cache-dir', type=str, default='cache')
+
+    subparsers = parser.add_subparsers(required=True)
+
+    stats_parser = subparsers.add_parser('stats', help='size of the cache stores')
+    stats_parser.set_defaults(action='stats')
+
+    prune_parser = subparsers.add_parser(
+        'prune', help='evict least recently used entries until stores fit the limits')
+    prune_parser.set_defaults(action='prune')
+    prune_parser.add_argument('--max-bytes', type=int, default=None, help='per store')
+    prune_parser.add_argument('--max-entries', type=int, default=None, help='per store')
+    prune_parser.add_argument(
+        '--older-than-days', type=float, default=None,
+        help='evict entries not accessed for that many days')
+
+    args = parser.parse_args()
+
+    coloredlogs.install(level=logging.INFO, logger=LOGGER)
+
+    rows = []
+    for dir_path in get_store_dirs(args.cache_dir):
+        if not os.path.exists(dir_path):
+            continue
+
+        store = CacheStore(dir_path)
+        try:
+            # entries might have been written or removed by an older version
+            store.reindex()
+
+            if args.action == 'prune':
+                evicted = store.evict(
+                    max_bytes=args.max_bytes, max_entries=args.max_entries,
+                    accessed_before=(
+                        time.time() - args.older_than_days * 24 * 3600
+                        if args.older_than_days is not None else None))
+                LOGGER.info('%d entries evicted from "%s"', evicted, dir_path)
+
+            stats = store.stats()
+        finally:
+            store.close()
+
+        rows.append([
+            dir_path, stats['entries'], format_size(stats['bytes']),
+            format_access_time(stats['oldest_access']),
+            format_access_time(stats['newest_access']),
+        ])
+
+    print(tabulate.tabulate(
+        rows, headers=['store', 'entries', 'size', 'oldest access', 'newest access']))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        LOGGER.fatal('error! %s', err, exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,198 @@
+import array
+import gzip
+import itertools
+import pickle
+import struct
+import zlib
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import pandas
+
+# value files written by the codecs start with it, files without it are
+# gzip-compressed pickles written by the previous versions
+MAGIC = b'JULC'
+
+# trades some compression ratio for much faster writes
+COMPRESSION_LEVEL = 1
+
+# shorter lists of rows are not worth converting into columns
+MIN_COLUMNAR_ROWS = 16
+
+LENGTH = struct.Struct('<Q')
+
+
+class ColumnarRows:
+    """
+    List of dicts (e.g. diff rows) stored column by column, so that keys are
+    not repeated for every row. Rows are grouped by their keys (usually all
+    of them have the same ones), key order of every row is preserved.
+    """
+
+    def __init__(self, rows: List[Dict]):
+        rows_by_keys: Dict[tuple, List[Dict]] = {}
+        shape_idx_by_keys: Dict[tuple, int] = {}
+        self.row_shapes = array.array('I')
+
+        for row in rows:
+            keys = tuple(row)
+            shape_rows = rows_by_keys.get(keys)
+            if shape_rows is None:
+                shape_rows = rows_by_keys[keys] = []
+                shape_idx_by_keys[keys] = len(shape_idx_by_keys)
+            shape_rows.append(row)
+            self.row_shapes.append(shape_idx_by_keys[keys])
+
+        # keys along with the columns of the rows having them
+        self.shapes: List[Tuple[tuple, list]] = [
+            (keys, list(zip(*(row.values() for row in shape_rows))))
+            for keys, shape_rows in rows_by_keys.items()
+        ]
+
+        # order is obvious when there is a single shape (and amount of rows
+        # is known from the columns)
+        if len(self.shapes) == 1 and self.shapes[0][0]:
+            self.row_shapes = None
+
+    def __reduce__(self):
+        # unpickled right into the list of dicts
+        return rows_from_columns, (self.shapes, self.row_shapes)
+
+
+def rows_from_columns(shapes: List[Tuple[tuple, list]], row_shapes: Optional[array.array]) -> List[Dict]:
+    shape_rows = [
+        list(map(dict, map(zip, itertools.repeat(keys), zip(*columns)))) if keys
+        else [{} for _ in range(row_shapes.count(shape_idx))]
+        for shape_idx, (keys, columns) in enumerate(shapes)
+    ]
+
+    if row_shapes is None:
+        return shape_rows[0]
+
+    shape_iters = [iter(rows) for rows in shape_rows]
+    return [next(shape_iters[shape_idx]) for shape_idx in row_shapes]
+
+
+def is_rows(value: Any) -> bool:
+    return (
+        type(value) is list and len(value) >= MIN_COLUMNAR_ROWS and
+        all(type(item) is dict for item in value)
+    )
+
+
+def columnarize(value: Any) -> Any:
+    # looks for the rows within the containers cached values are made of
+    # (e.g. diff result is a dict of row lists)
+    if is_rows(value):
+        return ColumnarRows(value)
+    elif type(value) is dict:
+        return {key: columnarize(item) for key, item in value.items()}
+    elif type(value) is tuple:
+        return tuple(columnarize(item) for item in value)
+    return value
+
+
+class Codec:
+    """
+    Turns value into the pickle stream and the list of out-of-band buffers
+    (e.g. numeric columns of the data frames) and back.
+    """
+
+    name: str = None
+
+    def encode(self, value: Any) -> Tuple[bytes, List[pickle.PickleBuffer]]:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), []
+
+    def decode(self, stream, buffers: List[bytearray]) -> Any:
+        return pickle.loads(stream)
+
+
+class PickleCodec(Codec):
+    name = 'pickle'
+
+
+class ColumnarCodec(Codec):
+    """
+    Pickle protocol 5 with the buffers of the data frames (and NumPy arrays)
+    kept out-of-band, so they are neither copied nor escaped by the pickle,
+    and lists of dicts stored as columns.
+    """
+
+    name = 'columnar'
+
+    def encode(self, value: Any) -> Tuple[bytes, List[pickle.PickleBuffer]]:
+        buffers = []
+        stream = pickle.dumps(columnarize(value), protocol=5, buffer_callback=buffers.append)
+        return stream, buffers
+
+    def decode(self, stream, buffers: List[bytearray]) -> Any:
+        return pickle.loads(stream, buffers=buffers)
+
+
+CODECS: Dict[str, Codec] = {
+    codec.name: codec for codec in [PickleCodec(), ColumnarCodec()]
+}
+
+# codec id stored in the file
+CODEC_IDS: Dict[str, int] = {'pickle': 1, 'columnar': 2}
+CODEC_BY_ID: Dict[int, str] = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+
+def select_codec(value: Any) -> Codec:
+    # data frames and containers of rows are the bulk of the cached values
+    if isinstance(value, (pandas.DataFrame, dict, list, tuple)):
+        return CODECS['columnar']
+    return CODECS['pickle']
+
+
+def write_value(f: BinaryIO, value: Any, codec: Optional[Codec] = None) -> int:
+    """
+    Writes the value using given (or selected by the value type) codec,
+    returns size of the encoded value before compression.
+    """
+    codec = codec or select_codec(value)
+    stream, buffers = codec.encode(value)
+    chunks = [stream] + [buffer.raw() for buffer in buffers]
+
+    f.write(MAGIC)
+    f.write(bytes([CODEC_IDS[codec.name]]))
+    f.write(LENGTH.pack(len(buffers)))
+
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    for chunk in chunks:
+        f.write(compressor.compress(LENGTH.pack(len(chunk))))
+        f.write(compressor.compress(chunk))
+    f.write(compressor.flush())
+
+    return sum(len(chunk) for chunk in chunks)
+
+
+def read_value(f: BinaryIO) -> Tuple[Any, int]:
+    """
+    Returns the value along with its size before compression.
+    """
+    header = f.read(len(MAGIC))
+
+    if header != MAGIC:
+        # written by the previous version
+        f.seek(0)
+        with gzip.GzipFile(fileobj=f, mode='rb') as gzip_file:
+            data = gzip_file.read()
+        return pickle.loads(data), len(data)
+
+    codec_id, = f.read(1)
+    buffers_count, = LENGTH.unpack(f.read(LENGTH.size))
+    body = memoryview(zlib.decompress(f.read()))
+
+    chunks = []
+    offset = 0
+    for _ in range(buffers_count + 1):
+        length, = LENGTH.unpack_from(body, offset)
+        offset += LENGTH.size
+        chunks.append(body[offset:offset + length])
+        offset += length
+
+    stream, *buffers = chunks
+    # decoded arrays have to be writable
+    buffers = [bytearray(buffer) for buffer in buffers]
+
+    return CODECS[CODEC_BY_ID[codec_id]].decode(stream, buffers), len(body)
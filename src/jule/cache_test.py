@@ -0,0 +1,30 @@
+import unittest
+
+from jule.cache import normalize_query
+
+
+class NormalizeQueryTest(unittest.TestCase):
+    def test_whitespace_is_collapsed(self):
+        self.assertEqual(
+            normalize_query('select  1,\n\t2 ;'),
+            normalize_query('select 1, 2'))
+
+    def test_quoted_text_is_kept(self):
+        self.assertEqual(
+            normalize_query("select 'a  b', \"c -- d\""),
+            "select 'a  b', \"c -- d\"")
+
+    def test_line_comment_ends_with_line(self):
+        self.assertNotEqual(
+            normalize_query('select 1 -- x\n, 2'),
+            normalize_query('select 1 -- x , 2'))
+        self.assertEqual(normalize_query('select 1 -- x\n, 2'), 'select 1 , 2')
+
+    def test_block_comment_is_dropped(self):
+        self.assertEqual(
+            normalize_query('select /* a\nb */ 1'),
+            normalize_query('select 1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,7 @@ from ldap.controls.pagedresults import SimplePagedResultsControl
 from ldap.ldapobject import LDAPObject
 
 from jule.common import fully_qualified_class_name
+from jule.history import HistoryStore, get_history_path
 from jule.plugin import LdapQuerySet, load_from_module, get_default_plugin_class_name
 from jule.state import LdapStorageContainer, LdapSnapshotData, LdapSnapshotMetadata
 
@@ -116,6 +117,10 @@ def main():
     parser.add_argument('--data-dir', type=str, default='data', required=False)
     parser.add_argument('--log-path', type=str, default='collect.log', required=False)
     parser.add_argument('--plugin-module', type=str, default=get_default_plugin_class_name())
+    parser.add_argument('--cache-dir', type=str, default='cache', required=False)
+    parser.add_argument(
+        '--update-history', action='store_true', default=False,
+        help='ingest collected snapshot into the history database right away')
 
     args = parser.parse_args()
 
@@ -170,6 +175,17 @@ def main():
     with open(path, 'wb') as f:
         container.save(f)
 
+    if args.update_history:
+        if not os.path.exists(args.cache_dir):
+            LOGGER.warning('Cache dir does not exist -> creating')
+            os.makedirs(args.cache_dir)
+
+        history_store = HistoryStore(get_history_path(args.cache_dir), plugin)
+        try:
+            history_store.ingest(path)
+        finally:
+            history_store.close()
+
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,235 @@
+import base64
+import logging
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import pandas
+
+from jule.extract import extract_records
+from jule.plugin import ExtractorBase
+from jule.snapshot_cache import SNAPSHOT_CACHE
+from jule.state import LdapSnapshotData
+
+LOGGER = logging.getLogger(__name__)
+
+ADDED = 'added'
+REMOVED = 'removed'
+COMMON = 'common'
+CHANGED = 'changed'
+
+# increment whenever result of the diff changes, so that cached results of
+# the previous version are not used
+DIFF_ALGORITHM_VERSION = 2
+
+RAW_COLUMNS = ['dn', 'attribute', 'value']
+
+Entry = Tuple[str, dict]
+DiffItem = Tuple[str, str, Optional[dict], Optional[dict]]
+
+
+def iter_sorted_entries(snapshot: LdapSnapshotData) -> Iterator[Entry]:
+    # snapshots saved before entries were ordered have to be sorted here
+    entries = snapshot.entries
+    if not snapshot.sorted_by_dn:
+        entries = sorted(entries, key=lambda t: t[0])
+
+    # same DN might be fetched more than once, the last one wins (as it does
+    # for "entry_by_dn" of the extractor)
+    previous = None
+    for entry in entries:
+        if previous is not None and previous[0] != entry[0]:
+            yield previous
+        previous = entry
+    if previous is not None:
+        yield previous
+
+
+def merge_diff(
+        current_entries: Iterable[Entry],
+        baseline_entries: Iterable[Entry]) -> Iterator[DiffItem]:
+    """
+    Merges two streams of entries ordered by DN in a single pass yielding
+    (action, dn, current entry, baseline entry) for every DN where action is
+    one of ADDED, REMOVED or COMMON (present in both, maybe changed).
+    """
+    current_iter = iter(current_entries)
+    baseline_iter = iter(baseline_entries)
+    current = next(current_iter, None)
+    baseline = next(baseline_iter, None)
+
+    while current is not None or baseline is not None:
+        if baseline is None or (current is not None and current[0] < baseline[0]):
+            yield ADDED, current[0], current[1], None
+            current = next(current_iter, None)
+        elif current is None or baseline[0] < current[0]:
+            yield REMOVED, baseline[0], None, baseline[1]
+            baseline = next(baseline_iter, None)
+        else:
+            yield COMMON, current[0], current[1], baseline[1]
+            current = next(current_iter, None)
+            baseline = next(baseline_iter, None)
+
+
+def diff_snapshots(
+        current_snapshot: LdapSnapshotData,
+        baseline_snapshot: LdapSnapshotData) -> Iterator[DiffItem]:
+    return merge_diff(
+        iter_sorted_entries(current_snapshot),
+        iter_sorted_entries(baseline_snapshot))
+
+
+def decode_raw_value(value) -> str:
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf8')
+        except UnicodeDecodeError:
+            return 'base64:' + base64.b64encode(value).decode('ascii')
+    return str(value)
+
+
+def explode_entries(entry_by_dn: Mapping[str, dict], dns: Iterable[str]) -> pandas.DataFrame:
+    # one row per every value of every attribute
+    records = [
+        (entry_dn, attr, value)
+        for entry_dn in dns
+        for attr, values in entry_by_dn[entry_dn].items()
+        for value in (values if isinstance(values, (list, tuple)) else [values])
+    ]
+    return pandas.DataFrame.from_records(records, columns=RAW_COLUMNS).drop_duplicates()
+
+
+def raw_diff(
+        current_entry_by_dn: Mapping[str, dict],
+        baseline_entry_by_dn: Mapping[str, dict],
+        dns: Iterable[str]) -> List[Dict]:
+    """
+    Compares raw attributes of the given entries present in both snapshots
+    treating values of every attribute as a set, returns row per changed
+    attribute with lists of added and removed values.
+    """
+    dns = list(dns)
+    merged = pandas.merge(
+        explode_entries(current_entry_by_dn, dns),
+        explode_entries(baseline_entry_by_dn, dns),
+        how='outer', on=RAW_COLUMNS, indicator=True)
+    merged = merged[merged['_merge'] != 'both']
+
+    if merged.empty:
+        return []
+
+    merged = merged.assign(
+        value=merged['value'].map(decode_raw_value),
+        side=merged['_merge'].map({'left_only': 'added', 'right_only': 'removed'}).astype(str))
+    grouped = merged.groupby(['dn', 'attribute', 'side'])['value'].agg(sorted).unstack('side')
+
+    return [
+        {
+            'dn': entry_dn,
+            'attribute': attr,
+            'added': row.get('added') if isinstance(row.get('added'), list) else [],
+            'removed': row.get('removed') if isinstance(row.get('removed'), list) else [],
+        }
+        for (entry_dn, attr), row in grouped.iterrows()
+    ]
+
+
+def iter_changed_dns(
+        current_snapshot: LdapSnapshotData,
+        baseline_snapshot: LdapSnapshotData) -> Iterator[str]:
+    """
+    Yields DNs of the entries present in both snapshots with different
+    attributes.
+    """
+    current_digests = current_snapshot.get_entry_digests()
+    baseline_digests = baseline_snapshot.get_entry_digests()
+    for action, entry_dn, _, _ in diff_snapshots(current_snapshot, baseline_snapshot):
+        if action == COMMON and current_digests[entry_dn] != baseline_digests[entry_dn]:
+            yield entry_dn
+
+
+def diff_containers(
+        extractor_class: type[ExtractorBase],
+        container_path: str, baseline_path: str) -> Dict[str, List[Dict]]:
+    """
+    Computes the whole difference between two snapshots at once: records of
+    ADDED and REMOVED entries and rows of the CHANGED ones (new properties,
+    old properties prefixed with "old_" and the list of updated ones).
+    """
+    # snapshot of the timeline is a part of two pairs, so it is loaded once
+    # and then taken from the cache
+    current_extractor = SNAPSHOT_CACHE.get_extractor(container_path, extractor_class)
+    baseline_extractor = SNAPSHOT_CACHE.get_extractor(baseline_path, extractor_class)
+
+    current_digests = current_extractor.snapshot.get_entry_digests()
+    baseline_digests = baseline_extractor.snapshot.get_entry_digests()
+
+    # common entries are split by whether the entry itself changed
+    dns_by_action = {ADDED: [], REMOVED: [], COMMON: []}
+    same_dns = []
+    for action, entry_dn, _, _ in diff_snapshots(
+            current_extractor.snapshot, baseline_extractor.snapshot):
+        if action == COMMON and current_digests[entry_dn] == baseline_digests[entry_dn]:
+            same_dns.append(entry_dn)
+        else:
+            dns_by_action[action].append(entry_dn)
+
+    # entry which did not change by itself might still have different
+    # properties when entries it refers to changed (e.g. manager got renamed)
+    touched_dns = set(dns_by_action[ADDED]) | set(dns_by_action[REMOVED]) | set(dns_by_action[COMMON])
+
+    def is_affected(entry_dn: str) -> bool:
+        referenced_dns = current_extractor.get_referenced_dns(entry_dn)
+        return referenced_dns is None or any(dn in touched_dns for dn in referenced_dns)
+
+    candidate_dns = sorted(dns_by_action[COMMON] + [
+        entry_dn for entry_dn in same_dns if is_affected(entry_dn)
+    ])
+
+    LOGGER.debug(
+        'extracting %d of %d common entries (the rest did not change)',
+        len(candidate_dns), len(dns_by_action[COMMON]) + len(same_dns))
+
+    new_records = extract_records(current_extractor, candidate_dns, skip_missing=True)
+    old_records = extract_records(baseline_extractor, candidate_dns, skip_missing=True)
+
+    changed = []
+
+    for new_data, old_data in zip(new_records, old_records):
+        common_props = set(new_data.keys()) & set(old_data.keys())
+
+        updated_props = [
+            prop for prop in common_props
+            if new_data[prop] != old_data[prop]
+        ]
+
+        if not updated_props:
+            continue
+
+        # rename the fields
+        old_data = {'old_' + prop: old_data[prop] for prop in old_data}
+
+        changed.append(dict(
+            **new_data,
+            **old_data,
+            updated_props=', '.join(updated_props),
+        ))
+
+    return {
+        ADDED: extract_records(current_extractor, dns_by_action[ADDED]),
+        REMOVED: extract_records(baseline_extractor, dns_by_action[REMOVED]),
+        CHANGED: changed,
+    }
+
+
+def diff_containers_raw(
+        extractor_class: type[ExtractorBase],
+        container_path: str, baseline_path: str) -> List[Dict]:
+    """
+    Computes changed raw attributes of the entries (see "raw_diff"), which is
+    way more expensive than the rest of the diff and needed by fewer views.
+    """
+    current_extractor = SNAPSHOT_CACHE.get_extractor(container_path, extractor_class)
+    baseline_extractor = SNAPSHOT_CACHE.get_extractor(baseline_path, extractor_class)
+
+    return raw_diff(
+        current_extractor.entry_by_dn, baseline_extractor.entry_by_dn,
+        iter_changed_dns(current_extractor.snapshot, baseline_extractor.snapshot))
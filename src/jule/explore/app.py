@@ -12,14 +12,35 @@ from textual.containers import ScrollableContainer
 from textual.widgets import Header, Footer, Static, ListView, ListItem
 
 from jule import VERSION
-from jule.cache import CacheStore
+from jule.cache import (
+    CacheStore,
+    QueryResultCache,
+    QUERY_RESULTS_CACHE_DIR,
+    get_default_max_bytes,
+    get_default_max_entries,
+    get_default_memory_max_bytes,
+)
 from jule.explore.changes_screen import ChangesScreen
+from jule.explore.common import (
+    BUCKET_KEY_FUNCS,
+    DEFAULT_GRANULARITY,
+    DEFAULT_PICK_STRATEGY,
+    PICK_STRATEGIES,
+)
+from jule.explore.entry_history_screen import EntryHistoryScreen
 from jule.explore.help_screen import HelpScreen
+from jule.explore.history_screen import HistoryScreen
 from jule.explore.settings import AppSettings
 from jule.explore.snapshot_picker_screen import SnapshotPickerScreen
 from jule.explore.timeline_screen import TimelineScreen
 from jule.explore.under_construction_screen import UnderConstructionScreen
-from jule.plugin import PluginBase, load_from_module, get_default_plugin_class_name
+from jule.extract import start_pool_server
+from jule.plugin import (
+    PluginBase,
+    enable_profiling,
+    load_from_module,
+    get_default_plugin_class_name,
+)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -62,7 +83,14 @@ ListView > ListItem {
     def __init__(self, *args, settings: AppSettings, **kwargs):
         super().__init__(*args, **kwargs)
         self.settings = settings
-        self.cache_store = CacheStore(settings.cache_dir)
+        self.cache_store = CacheStore(
+            settings.cache_dir,
+            max_bytes=get_default_max_bytes(),
+            max_entries=get_default_max_entries(),
+            memory_max_bytes=get_default_memory_max_bytes())
+        self.query_result_cache = QueryResultCache(
+            os.path.join(settings.cache_dir, QUERY_RESULTS_CACHE_DIR),
+            memory_max_bytes=get_default_memory_max_bytes() // 4)
 
     @property
     def plugin(self) -> PluginBase:
@@ -82,6 +110,7 @@ ListView > ListItem {
             ListItem(Static('COMPARE SNAPSHOTS'), id='compare-view'),
             ListItem(Static('DEADPOOL / NEW HIRES'), id='timeline-view'),
             ListItem(Static('PROPERTIES CHANGES'), id='changes-view'),
+            ListItem(Static('HISTORY'), id='history-view'),
             ListItem(Static('EXIT'), id='quit'),
         )
         menu_items_view.styles.height = 'auto'
@@ -96,6 +125,9 @@ ListView > ListItem {
     def action_toggle_dark(self) -> None:
         self.dark = not self.dark
 
+    def open_entry_history(self, dn: str):
+        self.push_screen(EntryHistoryScreen(dn=dn))
+
     @on(ListView.Selected)
     def on_menu_item(self, event):
         if event.item.id == 'explore-view':
@@ -104,6 +136,8 @@ ListView > ListItem {
             self.push_screen('timeline_screen')
         elif event.item.id == 'changes-view':
             self.push_screen('changes_screen')
+        elif event.item.id == 'history-view':
+            self.push_screen('history_screen')
         elif event.item.id == 'quit':
             self.exit()
         else:
@@ -117,6 +151,16 @@ def main():
     parser.add_argument('--export-dir', type=str, default='export')
     parser.add_argument('--log-path', type=str, default='explore.log')
     parser.add_argument('--plugin-module', type=str, default=get_default_plugin_class_name())
+    parser.add_argument(
+        '--profile-extraction', action='store_true', default=False,
+        help='log per property extraction stats when leaving a screen')
+    parser.add_argument(
+        '--timeline-granularity', type=str, default=DEFAULT_GRANULARITY,
+        choices=BUCKET_KEY_FUNCS.keys(),
+        help='time bucket of the timeline and changes screens')
+    parser.add_argument(
+        '--timeline-pick', type=str, default=DEFAULT_PICK_STRATEGY, choices=PICK_STRATEGIES,
+        help='snapshot representing the time bucket')
     args = parser.parse_args()
 
     logging.basicConfig(
@@ -128,6 +172,9 @@ def main():
 
     coloredlogs.install(level=logging.DEBUG)
 
+    if args.profile_extraction:
+        enable_profiling()
+
     if not os.path.exists(args.cache_dir):
         LOGGER.warning('Cache dir does not exist -> creating')
         os.makedirs(args.cache_dir)
@@ -143,6 +190,8 @@ def main():
             cache_dir=args.cache_dir,
             export_dir=args.export_dir,
             plugin=plugin,
+            timeline_granularity=args.timeline_granularity,
+            timeline_pick_strategy=args.timeline_pick,
         )
 
         ExplorerApp.SUB_TITLE = (
@@ -169,6 +218,14 @@ def main():
             'changes_screen'
         )
 
+        app.install_screen(
+            HistoryScreen(),
+            'history_screen'
+        )
+
+        # worker pools can not start it once TUI captures the output
+        start_pool_server()
+
         app.run()
 
         LOGGER.debug('exit')
@@ -1,16 +1,23 @@
 import functools
+import json
 import os.path
+import re
 from typing import List, Dict
 
-import pandasql
+import pandas
 from textual.app import ComposeResult
 from textual.widgets import LoadingIndicator, Footer
 
+from jule.diff import CHANGED
 from jule.explore.breadcrumb_widget import Breadcrumb
 from jule.explore.common import (
     remove_empty_columns,
+    calculate_rollups,
     construct_timeline_data,
-    make_cached_diff_func,
+    make_shared_diff_func,
+    make_raw_diff_func,
+    DIFF_FUNC,
+    DIFF_RESULT_FUNC,
     construct_data_frame_help_text,
 )
 from jule.explore.data_frame_view_widget import DataFrameView
@@ -18,67 +25,59 @@ from jule.explore.error_screen import ErrorScreen
 from jule.explore.placeholder_widget import PlaceholderWidget
 from jule.explore.query_picker_screen import QueryPickerScreen
 from jule.explore.screen_base import ScreenBase
-from jule.plugin import ExtractorBase
-from jule.state import try_load
+from jule.explore.status_line_widget import StatusLine
+from jule.sql import SqlSession, QueryError
 
 QUERY_PICKER_SCREEN_NAME = 'query-picker-for-changes-viewer'
 
+# columns tables have even when there were no changes, so that queries
+# against them still run
+CHANGES_COLUMNS = ['dn', 'updated_props', 'path', 'baseline_path', 'bucket_key']
+RAW_CHANGES_COLUMNS = ['dn', 'attribute', 'added', 'removed', 'path', 'baseline_path', 'bucket_key']
+
 
 def diff(
-        extractor_class: type[ExtractorBase],
+        diff_fn: DIFF_RESULT_FUNC,
         data_dir: str, container_path: str, baseline_path: str) -> List[Dict]:
-    current_container = try_load(container_path, load_data=True)
-    baseline_container = try_load(baseline_path, load_data=True)
-
-    assert current_container is not None
-    assert baseline_container is not None
-
-    current_extractor = extractor_class(current_container.data)
-    baseline_extractor = extractor_class(baseline_container.data)
-
-    baseline_entries = {
-        entry_dn: entry_data
-        for entry_dn, entry_data in baseline_container.data.entries
-    }
-    current_entries = {
-        entry_dn: entry_data
-        for entry_dn, entry_data in current_container.data.entries
-    }
-
-    result = []
-
-    def extract_entry(entry_dn: str, extractor: ExtractorBase):
-        return extractor.extract_all(entry_dn, skip_missing=True)
-
-    for entry_dn, entry_data in current_entries.items():
-        if entry_dn not in baseline_entries:
-            continue
-
-        new_data = extract_entry(entry_dn, current_extractor)
-        old_data = extract_entry(entry_dn, baseline_extractor)
+    return [
+        dict(
+            row,
+            path=os.path.relpath(container_path, data_dir),
+            baseline_path=os.path.relpath(baseline_path, data_dir),
+        )
+        for row in diff_fn(container_path, baseline_path)[CHANGED]
+    ]
 
-        common_props = set(new_data.keys()) & set(old_data.keys())
 
-        updated_props = [
-            prop for prop in common_props
-            if new_data[prop] != old_data[prop]
-        ]
+def raw_diff(
+        diff_fn: DIFF_FUNC,
+        data_dir: str, container_path: str, baseline_path: str) -> List[Dict]:
+    # value lists are stored as JSON arrays, so that SQL can unnest them
+    # with "json_each"
+    return [
+        dict(
+            row,
+            added=json.dumps(row['added']),
+            removed=json.dumps(row['removed']),
+            path=os.path.relpath(container_path, data_dir),
+            baseline_path=os.path.relpath(baseline_path, data_dir),
+        )
+        for row in diff_fn(container_path, baseline_path)
+    ]
 
-        if not updated_props:
-            continue
 
-        # rename the fields
-        old_data = {'old_' + prop: old_data[prop] for prop in old_data}
+def rollup_changes(dimensions: List[str], data_frame: pandas.DataFrame) -> pandas.DataFrame:
+    # change of several properties is counted once per every property
+    data_frame = data_frame.assign(
+        updated_prop=data_frame.get('updated_props', pandas.Series(dtype=str)).str.split(', '),
+    ).explode('updated_prop')
+    return calculate_rollups(data_frame, dimensions, group_columns=['updated_prop'])
 
-        result.append(dict(
-            **new_data,
-            **old_data,
-            updated_props=', '.join(updated_props),
-            path=os.path.relpath(container_path, data_dir),
-            baseline_path=os.path.relpath(baseline_path, data_dir),
-        ))
 
-    return result
+def ensure_columns(data_frame: pandas.DataFrame, columns: List[str]) -> pandas.DataFrame:
+    if len(data_frame) != 0:
+        return data_frame
+    return pandas.DataFrame(columns=columns)
 
 
 # TODO: mode where we diff only using FULL snapshots
@@ -86,8 +85,9 @@ class ChangesScreen(ScreenBase):
     TITLE = 'CHANGES'
 
     BINDINGS = [
-        ('escape', 'app.pop_screen', 'Back'),
+        ('escape', 'back', 'Back'),
         ('p', "open_picker", 'Query'),
+        ('i', 'entry_history', 'Entry history'),
     ]
 
     CSS = """
@@ -100,6 +100,9 @@ class ChangesScreen(ScreenBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.data_frame = None
+        self.sql_session = SqlSession()
+        self.empty_tables: List[str] = []
+        self.raw_changes_loaded = False
 
     @property
     def plugin_queries(self):
@@ -111,11 +114,13 @@ class ChangesScreen(ScreenBase):
     def compose(self) -> ComposeResult:
         yield Breadcrumb()
         yield Footer()
+        yield StatusLine()
         yield LoadingIndicator(id='loader')
 
         self.app.install_screen(
             QueryPickerScreen(
                 queries=self.plugin_queries,
+                explain_fn=self.sql_session.explain,
             ), name=QUERY_PICKER_SCREEN_NAME
         )
 
@@ -140,52 +145,133 @@ class ChangesScreen(ScreenBase):
         self.query_one('#loader').display = False
 
     def load_data(self):
-        self.data_frame = construct_timeline_data(
-            self.settings.data_dir,
-            diff_calculation_fn=make_cached_diff_func(
+        # diff functions load and extract snapshots, so that is all "load"
+        with self.query_stats.measure('load'):
+            shared_diff_fn = make_shared_diff_func(self.cache_store, self.plugin)
+            timeline_data = construct_timeline_data(
+                self.settings.data_dir,
+                diff_calculation_fn=functools.partial(
+                    diff, shared_diff_fn, self.settings.data_dir),
+                prefetch_fn=functools.partial(
+                    shared_diff_fn.prefetch,
+                    progress_fn=functools.partial(self.report_progress, 'diffing snapshots')),
+                granularity=self.settings.timeline_granularity,
+                pick_strategy=self.settings.timeline_pick_strategy,
                 cache_store=self.cache_store,
-                cache_type='changes',
-                inner_diff_func=functools.partial(
-                    diff,
-                    self.settings.plugin.property_extractor_class,
-                    self.settings.data_dir)),
+                cache_properties=dict(
+                    shared_diff_fn.key_properties, view='changes',
+                    rollup_dimensions=','.join(self.plugin.rollup_dimensions)),
+                rollup_fn=functools.partial(rollup_changes, self.plugin.rollup_dimensions),
             )
-        self.data_frame = remove_empty_columns(self.data_frame)
+
+        self.data_frame = ensure_columns(remove_empty_columns(timeline_data.data_frame), CHANGES_COLUMNS)
+
+        tables = {
+            'changes': self.data_frame,
+            'rollups': timeline_data.rollups,
+        }
+
+        # tables are there even if empty, so that all the queries run
+        with self.query_stats.measure('import'):
+            for name, data_frame in tables.items():
+                self.sql_session.load_table(name, data_frame, index_columns=self.plugin.indexed_columns)
+
+        self.empty_tables = [name for name, data_frame in tables.items() if len(data_frame) == 0]
 
         self.app.call_from_thread(
             lambda: self.render_query(list(self.plugin_queries.values())[0])
         )
 
+    def load_raw_changes(self, query: str):
+        # raw attributes are compared only for the queries against
+        # "raw_changes", so they are diffed and cached on their own
+        with self.query_stats.measure('load'):
+            raw_diff_fn = make_raw_diff_func(self.cache_store, self.plugin)
+            raw_data_frame = construct_timeline_data(
+                self.settings.data_dir,
+                diff_calculation_fn=functools.partial(
+                    raw_diff, raw_diff_fn, self.settings.data_dir),
+                prefetch_fn=functools.partial(
+                    raw_diff_fn.prefetch,
+                    progress_fn=functools.partial(self.report_progress, 'diffing raw attributes')),
+                granularity=self.settings.timeline_granularity,
+                pick_strategy=self.settings.timeline_pick_strategy,
+                cache_store=self.cache_store,
+                cache_properties=dict(raw_diff_fn.key_properties, view='raw_changes'),
+            ).data_frame
+
+        raw_data_frame = ensure_columns(raw_data_frame, RAW_CHANGES_COLUMNS)
+
+        with self.query_stats.measure('import'):
+            self.sql_session.load_table(
+                'raw_changes', raw_data_frame, index_columns=self.plugin.indexed_columns)
+
+        if len(raw_data_frame) == 0:
+            self.empty_tables.append('raw_changes')
+        self.raw_changes_loaded = True
+
+        self.app.call_from_thread(lambda: self.render_query(query))
+
+    @staticmethod
+    def refers_table(name: str, query: str) -> bool:
+        return re.search(r'\b%s\b' % name, query, flags=re.IGNORECASE) is not None
+
+    def refers_empty_table(self, query: str) -> bool:
+        return any(self.refers_table(name, query) for name in self.empty_tables)
+
+    async def show_placeholder(self):
+        await self.query('#data').remove()
+        await self.mount(
+            PlaceholderWidget(id='data', text='NO DATA AVAILABLE')
+        )
+
     async def render_query(self, query: str):
         assert self.data_frame is not None
 
-        if len(self.data_frame) == 0:
-            self.hide_loader()
-            await self.mount(
-                PlaceholderWidget(text='NO DATA AVAILABLE')
-            )
+        if not self.raw_changes_loaded and self.refers_table('raw_changes', query):
+            self.query_one('#loader').display = True
+            self.app.run_worker(
+                functools.partial(self.load_raw_changes, query),
+                exclusive=True, thread=True)
             return
 
+        self.query_stats.start_query()
+
         try:
-            result_frame = pandasql.sqldf(query, {
-                'changes': self.data_frame,
-            })
-        except pandasql.PandaSQLException as err:
+            with self.query_stats.measure('sql'):
+                result_frame = self.sql_session.query(query)
+        except QueryError as err:
             self.hide_loader()
+            # columns of the properties are not known when there were no
+            # changes at all
+            if self.refers_empty_table(query):
+                await self.show_placeholder()
+                return
             await self.app.push_screen(
                 ErrorScreen(error_message=str(err)),
             )
             return
 
-        await self.query('#data').remove()
+        self.hide_loader()
 
-        frame_view = DataFrameView(
-            id='data',
-            data_frame=result_frame,
-            export_dir=self.settings.export_dir,
-        )
+        if len(result_frame) == 0:
+            await self.show_placeholder()
+            self.query_stats.set_result(result_frame)
+            self.report_query_stats(query)
+            return
 
-        self.hide_loader()
-        await self.mount(frame_view)
+        with self.query_stats.measure('render'):
+            await self.query('#data').remove()
+
+            frame_view = DataFrameView(
+                id='data',
+                data_frame=result_frame,
+                export_dir=self.settings.export_dir,
+            )
+
+            await self.mount(frame_view)
 
         frame_view.focus()
+
+        self.query_stats.set_result(result_frame)
+        self.report_query_stats(query)
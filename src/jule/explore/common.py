@@ -1,8 +1,12 @@
 import collections
+import concurrent.futures
 import datetime
+import functools
+import logging
+import math
 import os
 import os.path
-from typing import List, Dict, Tuple, Callable, Optional
+from typing import List, Dict, Tuple, Callable, Optional, NamedTuple
 
 import pandas
 from rich.text import Text, Style
@@ -10,12 +14,23 @@ from textual.widget import Widget
 from textual.widgets import Static
 
 from jule.cache import CacheStore, calculate_hash
-from jule.state import LdapStorageContainer, LdapSnapshotMetadata, try_load
+from jule.common import fully_qualified_class_name
+from jule.diff import DIFF_ALGORITHM_VERSION, diff_containers, diff_containers_raw
+from jule.extract import get_default_workers_count, get_pool_context
+from jule.plugin import PROFILER, PluginBase, is_profiling_enabled
+from jule.state import (
+    LdapStorageContainer,
+    LdapSnapshotMetadata,
+    calculate_snapshot_fingerprint,
+    try_load,
+)
+
+LOGGER = logging.getLogger(__name__)
 
 
 def human_size(size: int):
     if size <= 1024:
-        return '%d B'
+        return '%d B' % size
     elif size <= 1024 * 1024:
         return '%.0f KiB' % (size / 1024.0)
     else:
@@ -42,34 +57,259 @@ DIFF_FUNC = Callable[[str, str], List[Dict]]
 FILTER_FUNC = Callable[[LdapSnapshotMetadata], bool]
 
 
-def make_cached_diff_func(
-        cache_store: CacheStore, cache_type: str, inner_diff_func: DIFF_FUNC):
-    def cached_diff(container_path: str, baseline_path: str):
-        cache_key = calculate_hash({
-            'cache_type': cache_type,
-            'container_path': container_path,
-            'baseline_path': baseline_path,
-        })
-        value = cache_store.get(cache_key)
+PROGRESS_FUNC = Callable[[int, int], None]
+PREFETCH_FUNC = Callable[[List[Tuple[str, str]]], None]
+
+
+def _init_diff_worker():
+    # pairs are already diffed in parallel, so every worker extracts the
+    # properties on its own
+    os.environ['JULE_EXTRACT_WORKERS'] = '1'
+
+
+def _diff_chain(diff_func: DIFF_FUNC, pairs: List[Tuple[str, str]]):
+    results = [diff_func(*pair) for pair in pairs]
+    # stats of the worker are reported by the parent
+    profile_stats = PROFILER.pop_stats() if is_profiling_enabled() else None
+    return results, profile_stats
+
+
+# more chains than workers balance the load better and report progress more
+# often at the cost of loading snapshots at the chain boundaries twice
+CHAINS_PER_WORKER = 4
+
+
+def split_into_chains(
+        pairs: List[Tuple[str, str]], max_chains: int) -> List[List[Tuple[str, str]]]:
+    """
+    Splits the pairs into the chunks of contiguous pairs (baseline of the
+    next one is the current of the previous one) of about the same size.
+    """
+    chains = []
+    for pair in pairs:
+        if chains and chains[-1][-1][0] == pair[1]:
+            chains[-1].append(pair)
+        else:
+            chains.append([pair])
+
+    chunk_size = max(1, math.ceil(len(pairs) / max_chains))
+
+    return [
+        chain[idx:idx + chunk_size]
+        for chain in chains
+        for idx in range(0, len(chain), chunk_size)
+    ]
+
+
+class CachedDiffFunc:
+    def __init__(
+            self, cache_store: CacheStore, cache_type: str, inner_diff_func: DIFF_FUNC,
+            key_properties: Optional[Dict[str, str]] = None):
+        self.cache_store: CacheStore = cache_store
+        self.cache_type: str = cache_type
+        # has to be picklable to be run by the pool workers
+        self.inner_diff_func: DIFF_FUNC = inner_diff_func
+        # whatever else result depends upon (e.g. plugin version)
+        self.key_properties: Dict[str, str] = key_properties or {}
+
+    def get_cache_key(self, container_path: str, baseline_path: str) -> str:
+        # snapshots are identified by the content, so that renamed ones are
+        # still found and rewritten ones are not
+        return calculate_hash(dict(
+            self.key_properties,
+            cache_type=self.cache_type,
+            container=calculate_snapshot_fingerprint(container_path),
+            baseline=calculate_snapshot_fingerprint(baseline_path),
+        ))
+
+    def __call__(self, container_path: str, baseline_path: str):
+        cache_key = self.get_cache_key(container_path, baseline_path)
+        value = self.cache_store.get(cache_key)
 
         if value is not None:
             return value
 
-        value = inner_diff_func(container_path, baseline_path)
-        cache_store.set(cache_key, value)
+        value = self.inner_diff_func(container_path, baseline_path)
+        self.cache_store.set(cache_key, value)
         return value
 
-    return cached_diff
+    def prefetch(
+            self, pairs: List[Tuple[str, str]],
+            progress_fn: Optional[PROGRESS_FUNC] = None,
+            workers: Optional[int] = None):
+        """
+        Calculates diffs of the pairs which are not cached yet using a pool
+        of worker processes, every result is cached as soon as it is ready.
+        """
+        missing_pairs = [
+            pair for pair in pairs
+            if not self.cache_store.contains(self.get_cache_key(*pair))
+        ]
+        done = len(pairs) - len(missing_pairs)
+
+        def report_progress():
+            if progress_fn is not None:
+                progress_fn(done, len(pairs))
+
+        report_progress()
+
+        if not missing_pairs:
+            return
+
+        workers = min(workers or get_default_workers_count(), len(missing_pairs))
+
+        if workers <= 1:
+            for pair in missing_pairs:
+                self(*pair)
+                done += 1
+                report_progress()
+            return
+
+        # contiguous pairs share the snapshots, so chains of them are handed
+        # to the same worker to load every shared snapshot only once there
+        chunks = split_into_chains(missing_pairs, workers * CHAINS_PER_WORKER)
+
+        LOGGER.debug(
+            'diffing %d pairs in %d chains using %d workers...',
+            len(missing_pairs), len(chunks), workers)
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_pool_context(),
+                initializer=_init_diff_worker) as executor:
+            future_to_chunk = {
+                executor.submit(_diff_chain, self.inner_diff_func, chunk): chunk
+                for chunk in chunks
+            }
+            for future in concurrent.futures.as_completed(future_to_chunk):
+                results, profile_stats = future.result()
+                if profile_stats:
+                    PROFILER.merge(profile_stats)
+                for pair, value in zip(future_to_chunk[future], results):
+                    self.cache_store.set(self.get_cache_key(*pair), value)
+                    done += 1
+                report_progress()
+
+
+def make_cached_diff_func(
+        cache_store: CacheStore, cache_type: str, inner_diff_func: DIFF_FUNC,
+        key_properties: Optional[Dict[str, str]] = None) -> CachedDiffFunc:
+    return CachedDiffFunc(cache_store, cache_type, inner_diff_func, key_properties)
+
+
+DIFF_RESULT_FUNC = Callable[[str, str], Dict[str, List[Dict]]]
+
+# cache type of the combined diff shared by the timeline and changes screens
+SHARED_DIFF_CACHE_TYPE = 'diff'
+RAW_DIFF_CACHE_TYPE = 'raw-diff'
+
+
+def get_diff_key_properties(plugin: PluginBase) -> Dict[str, str]:
+    return {
+        'plugin': fully_qualified_class_name(type(plugin)),
+        'plugin_version': str(plugin.version),
+        'diff_version': str(DIFF_ALGORITHM_VERSION),
+    }
+
+
+def make_shared_diff_func(cache_store: CacheStore, plugin: PluginBase) -> CachedDiffFunc:
+    """
+    Returns cached function computing added, removed and changed entries of
+    the snapshot pair all at once, so that every screen takes its own view
+    of the result computed just once.
+    """
+    return make_cached_diff_func(
+        cache_store=cache_store,
+        cache_type=SHARED_DIFF_CACHE_TYPE,
+        inner_diff_func=functools.partial(diff_containers, plugin.property_extractor_class),
+        key_properties=get_diff_key_properties(plugin))
+
+
+def make_raw_diff_func(cache_store: CacheStore, plugin: PluginBase) -> CachedDiffFunc:
+    """
+    Returns cached function computing changed raw attributes of the snapshot
+    pair, kept apart from the shared diff as only the changes screen needs it.
+    """
+    return make_cached_diff_func(
+        cache_store=cache_store,
+        cache_type=RAW_DIFF_CACHE_TYPE,
+        inner_diff_func=functools.partial(diff_containers_raw, plugin.property_extractor_class),
+        key_properties=get_diff_key_properties(plugin))
+
+
+BUCKET_KEY_FUNCS: Dict[str, Callable[[datetime.datetime], str]] = {
+    'hour': lambda dt: dt.strftime('%Y-%m-%d %H:00'),
+    'day': lambda dt: dt.strftime('%Y-%m-%d'),
+    'week': lambda dt: dt.strftime('%G-W%V'),
+    'month': lambda dt: dt.strftime('%Y-%m'),
+}
+DEFAULT_GRANULARITY = 'day'
+
+# which snapshot represents the bucket
+PICK_STRATEGIES = ['earliest', 'latest']
+DEFAULT_PICK_STRATEGY = 'earliest'
+
+
+# bumped whenever layout of the persisted timeline changes
+TIMELINE_FORMAT_VERSION = 3
+
+ROLLUP_FUNC = Callable[[pandas.DataFrame], pandas.DataFrame]
+
+ROLLUP_COLUMNS = ['dimension', 'value', 'count']
+
+
+def calculate_rollups(
+        data_frame: pandas.DataFrame,
+        dimensions: List[str],
+        group_columns: List[str]) -> pandas.DataFrame:
+    """
+    Counts rows per bucket, group columns (e.g. action) and value of every
+    dimension (e.g. department) present in the frame. Result is a "long"
+    frame, so that all the dimensions share the same table.
+    """
+    keys = ['bucket_key'] + group_columns
+    frames = []
+
+    for dimension in dimensions:
+        if dimension not in data_frame.columns or len(data_frame) == 0:
+            continue
+        counts = data_frame.groupby(keys + [dimension], dropna=False).size()
+        frame = counts.reset_index(name='count').rename(columns={dimension: 'value'})
+        frame.insert(len(keys), 'dimension', dimension)
+        frames.append(frame)
+
+    if not frames:
+        return pandas.DataFrame(columns=keys + ROLLUP_COLUMNS)
+
+    return pandas.concat(frames, ignore_index=True)
+
+
+TimelineData = NamedTuple('TimelineData', [
+    ('data_frame', pandas.DataFrame),
+    ('rollups', Optional[pandas.DataFrame]),
+])
 
 
-# TODO: bucket key function should be externally provided
 def construct_timeline_data(
         data_dir: str,
         diff_calculation_fn: DIFF_FUNC,
-        filter: Optional[FILTER_FUNC] = None) -> pandas.DataFrame:
+        filter: Optional[FILTER_FUNC] = None,
+        prefetch_fn: Optional[PREFETCH_FUNC] = None,
+        granularity: str = DEFAULT_GRANULARITY,
+        pick_strategy: str = DEFAULT_PICK_STRATEGY,
+        cache_store: Optional[CacheStore] = None,
+        cache_properties: Optional[Dict[str, str]] = None,
+        rollup_fn: Optional[ROLLUP_FUNC] = None) -> TimelineData:
+    """
+    Builds frame of the diffs between the snapshots representing adjacent
+    time buckets. When cache store is given, the frame is persisted along
+    with the pairs it was built from, so that the next time only pairs which
+    are new (or have changed) since then are diffed. Rollups (if requested)
+    are calculated for the new rows only and maintained along with the frame.
+    """
+    bucket_key_func = BUCKET_KEY_FUNCS[granularity]
+
     def timestamp_to_bucket_key(timestamp: float) -> str:
-        dt = datetime.datetime.fromtimestamp(timestamp)
-        return dt.strftime('%Y-%m-%d')
+        return bucket_key_func(datetime.datetime.fromtimestamp(timestamp))
 
     containers: List[Tuple[str, LdapStorageContainer]] = []
 
@@ -95,25 +335,94 @@ def construct_timeline_data(
         buckets[bucket_key].append((path, container))
 
     ordered_bucket_keys = sorted(buckets.keys())
-    diff_entries = []
 
     def pick(items) -> str:
-        abs_path, container = sorted(items, key=lambda t: t[1].metadata.timestamp)[0]
+        ordered_items = sorted(items, key=lambda t: t[1].metadata.timestamp)
+        abs_path, container = ordered_items[0 if pick_strategy == 'earliest' else -1]
         return abs_path
 
-    for idx in range(1, len(ordered_bucket_keys)):
-        current_bucket_key = ordered_bucket_keys[idx]
-        baseline_bucket_key = ordered_bucket_keys[idx - 1]
-        diff_data = diff_calculation_fn(
-            pick(buckets[current_bucket_key]),
-            pick(buckets[baseline_bucket_key])
-        )
+    pairs = [
+        (pick(buckets[ordered_bucket_keys[idx]]), pick(buckets[ordered_bucket_keys[idx - 1]]))
+        for idx in range(1, len(ordered_bucket_keys))
+    ]
+
+    # pair is identified by the content of the snapshots, so that persisted
+    # rows are reused only when the same snapshots represent the buckets,
+    # paths relative to the data dir are there as rows might refer to them
+    pair_ids = [
+        (bucket_key,
+         os.path.relpath(container_path, data_dir), calculate_snapshot_fingerprint(container_path),
+         os.path.relpath(baseline_path, data_dir), calculate_snapshot_fingerprint(baseline_path))
+        for bucket_key, (container_path, baseline_path) in zip(ordered_bucket_keys[1:], pairs)
+    ]
+
+    cache_key = None
+    persisted = None
+
+    if cache_store is not None:
+        # timeline is found by the snapshots it starts with wherever the
+        # data dir is, later pairs are checked against the persisted ones
+        cache_key = calculate_hash(dict(
+            cache_properties or {},
+            cache_type='timeline',
+            format_version=str(TIMELINE_FORMAT_VERSION),
+            granularity=granularity,
+            pick_strategy=pick_strategy,
+            origin=':'.join(pair_ids[0][1:]) if pair_ids else '',
+        ))
+        persisted = cache_store.get(cache_key)
+
+    reused_count = 0
+    frames = []
+    rollup_frames = []
+
+    if persisted is not None:
+        persisted_pair_ids, persisted_frame, persisted_rollups = persisted
+        while (reused_count < min(len(pair_ids), len(persisted_pair_ids)) and
+               pair_ids[reused_count] == persisted_pair_ids[reused_count]):
+            reused_count += 1
+        reused_bucket_keys = [pair_id[0] for pair_id in pair_ids[:reused_count]]
+        if reused_count and len(persisted_frame):
+            frames.append(persisted_frame[persisted_frame['bucket_key'].isin(reused_bucket_keys)])
+        if reused_count and persisted_rollups is not None and len(persisted_rollups):
+            rollup_frames.append(
+                persisted_rollups[persisted_rollups['bucket_key'].isin(reused_bucket_keys)])
+
+    LOGGER.debug('timeline: %d of %d pairs are already built', reused_count, len(pairs))
+
+    new_pairs = pairs[reused_count:]
+    new_bucket_keys = ordered_bucket_keys[1 + reused_count:]
+
+    # e.g. calculates the missing diffs in parallel beforehand
+    if prefetch_fn is not None and new_pairs:
+        prefetch_fn(new_pairs)
+
+    diff_entries = []
+
+    for bucket_key, (container_path, baseline_path) in zip(new_bucket_keys, new_pairs):
+        diff_data = diff_calculation_fn(container_path, baseline_path)
         diff_entries.extend(
-            [dict(entry, bucket_key=current_bucket_key) for entry in diff_data])
+            [dict(entry, bucket_key=bucket_key) for entry in diff_data])
 
-    data_frame = pandas.DataFrame.from_records(diff_entries)
+    if diff_entries:
+        new_frame = pandas.DataFrame.from_records(diff_entries)
+        frames.append(new_frame)
+        if rollup_fn is not None:
+            rollup_frames.append(rollup_fn(new_frame))
 
-    return data_frame
+    data_frame = pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()
+
+    rollups = None
+    if rollup_fn is not None:
+        rollups = (
+            pandas.concat(rollup_frames, ignore_index=True) if rollup_frames
+            else rollup_fn(pandas.DataFrame(columns=['bucket_key']))
+        )
+
+    if cache_store is not None and (persisted is None or persisted[0] != pair_ids):
+        cache_store.set(cache_key, (pair_ids, data_frame, rollups))
+
+    return TimelineData(data_frame, rollups)
 
 
 def construct_data_frame_help_text(data_frame: pandas.DataFrame, accent_color='red') -> Widget:
@@ -3,7 +3,7 @@ import datetime
 import functools
 import os.path
 import uuid
-from typing import Dict
+from typing import Dict, Optional
 
 import pandas
 from rich.text import Text
@@ -63,11 +63,21 @@ DataFrameView DataTable {
 
         self.data_table.focus()
 
+    def get_cursor_record(self) -> Optional[Dict]:
+        # rows might be sorted, so the one under cursor is read from the table
+        if self.data_table.row_count == 0:
+            return None
+        values = self.data_table.get_row_at(self.data_table.cursor_row)
+        return {
+            str(column.label): None if value is self.NULL_REPLACEMENT else value
+            for column, value in zip(self.data_table.ordered_columns, values)
+        }
+
     def action_find(self):
         def check_exit(result: SearchModalScreenResult):
             if result is not None:
                 self.searcher.search(
-                    result.text, result.is_regex, result.is_case_sensitive)
+                    result.text, result.is_regex, result.is_case_sensitive, result.is_fuzzy)
 
         if not self.app.is_screen_installed(self.search_modal_name):
             self.app.install_screen(SearchModalScreen(), self.search_modal_name)
@@ -124,6 +134,8 @@ DataFrameView DataTable {
         # flip the sort state
         self.sort_state[event.column_key.value] = not self.sort_state[event.column_key.value]
 
+        self.searcher.on_table_sorted()
+
     @on(Unmount)
     def on_unmount(self, event: Unmount):
         if self.app.is_screen_installed(self.search_modal_name):
@@ -1,7 +1,15 @@
-import re
-from typing import Optional, Tuple
+import bisect
+import functools
+import threading
+from typing import List, Optional, Tuple
 
 from textual.widgets import DataTable
+from textual.widgets.data_table import RowKey
+
+from jule.name_index import NameIndex, TextMatcher, compile_search
+
+# fuzzy search visits only that many cells most similar to the text
+FUZZY_MATCHES_LIMIT = 20
 
 
 # TODO: support highlight all matches somehow? need to modify DataTable cells then
@@ -10,30 +18,93 @@ from textual.widgets import DataTable
 class DataTableSearcher:
     def __init__(self, data_table: DataTable):
         self.data_table: DataTable = data_table
-        self.regex: Optional[re.Pattern] = None
+        self.matcher: Optional[TextMatcher] = None
         self.last_occurrence: Optional[Tuple[int, int]] = None
+        # fuzzy searches are resolved via the index over the cells which is
+        # built in a worker on the first one and kept for as long as the
+        # table (plain and regex searches just scan the cells); cells are
+        # keyed by the row key, so that index stays valid when table gets
+        # sorted
+        self.index: Optional[NameIndex] = None
+        self.index_lock = threading.Lock()
+        self.matches: Optional[List[Tuple[RowKey, int]]] = None
+        # result of the fuzzy search started before the latest one is dropped
+        self.search_id: int = 0
+        # (row index, column index) of the matches in the current table
+        # order, resolved lazily and dropped when table gets sorted
+        self.positions: Optional[List[Tuple[int, int]]] = None
+
+    def get_index(self) -> NameIndex:
+        with self.index_lock:
+            if self.index is None:
+                self.index = NameIndex(
+                    ((row_key, col_idx), str(value))
+                    for row_key in self.data_table.rows
+                    for col_idx, value in enumerate(self.data_table.get_row(row_key))
+                )
+            return self.index
+
+    def get_positions(self) -> List[Tuple[int, int]]:
+        if self.positions is None:
+            self.positions = sorted(
+                (self.data_table.get_row_index(row_key), col_idx)
+                for row_key, col_idx in self.matches
+            )
+        return self.positions
+
+    def on_table_sorted(self):
+        self.positions = None
+
+    def find_next_indexed_match(self, start_row: int, start_col: int):
+        positions = self.get_positions()
+        idx = bisect.bisect_right(positions, (start_row, start_col))
+        return positions[idx] if idx < len(positions) else None
 
     def find_next_match(self, start_row: int = 0, start_col: int = 0):
+        if self.matches is not None:
+            return self.find_next_indexed_match(start_row, start_col)
+
         cols = len(self.data_table.columns)
         for row_idx in range(start_row, self.data_table.row_count):
             row_values = self.data_table.get_row_at(row_idx)
             for col_idx in range(cols):
                 if row_idx == start_row and col_idx <= start_col:
                     continue
-                if self.regex.search(str(row_values[col_idx])):
+                if self.matcher(str(row_values[col_idx])):
                     return row_idx, col_idx
         return None
 
-    def search(self, target: str, is_regex: bool = False, is_case_sensitive: bool = False):
-        flags = 0
-        if not is_case_sensitive:
-            flags = re.IGNORECASE
+    def search(
+            self, target: str, is_regex: bool = False, is_case_sensitive: bool = False,
+            is_fuzzy: bool = False):
+        self.matcher = compile_search(target, is_regex, is_case_sensitive)
+        self.matches = None
+        self.positions = None
+        self.last_occurrence = None
+        self.search_id += 1
 
-        if is_regex:
-            self.regex = re.compile(target, flags=flags)
-        else:
-            self.regex = re.compile('.*' + re.escape(target) + '.*', flags=flags)
+        if is_fuzzy:
+            self.data_table.app.run_worker(
+                functools.partial(self.search_fuzzy, target, self.search_id),
+                group='fuzzy-search', thread=True)
+            return
+
+        self.move_to_first_match()
+
+    def search_fuzzy(self, target: str, search_id: int):
+        # runs in the worker thread, as building the index takes a while
+        matches = [
+            key for key, _ in self.get_index().search_fuzzy(target, limit=FUZZY_MATCHES_LIMIT)
+        ]
+        self.data_table.app.call_from_thread(self.apply_fuzzy_matches, matches, search_id)
+
+    def apply_fuzzy_matches(self, matches: List[Tuple[RowKey, int]], search_id: int):
+        if search_id != self.search_id:
+            return
+        self.matches = matches
+        self.move_to_first_match()
 
+    def move_to_first_match(self):
         match = self.find_next_match(0, -1)
 
         if match is not None:
@@ -44,7 +115,7 @@ class DataTableSearcher:
             self._notify('Unable to find')
 
     def search_next(self):
-        if self.regex is None:
+        if self.matcher is None or self.last_occurrence is None:
             self._notify('Find something first')
             return
 
@@ -0,0 +1,91 @@
+import glob
+
+import pandas
+from textual.app import ComposeResult
+from textual.widgets import LoadingIndicator, Footer
+
+from jule.explore.breadcrumb_widget import Breadcrumb
+from jule.explore.data_frame_view_widget import DataFrameView
+from jule.explore.placeholder_widget import PlaceholderWidget
+from jule.explore.screen_base import ScreenBase
+from jule.explore.status_line_widget import StatusLine
+from jule.history import CHANGE_COLUMNS, HistoryStore, get_history_path
+
+
+class EntryHistoryScreen(ScreenBase):
+    """
+    Shows everything that happened to the given entry across all the
+    snapshots, renames included (see "changes" table of the history).
+    """
+
+    TITLE = 'ENTRY HISTORY'
+
+    BINDINGS = [
+        ('escape', 'back', 'Back'),
+    ]
+
+    CSS = """
+#data {
+    width: 100%;
+    height: 100%;
+}
+"""
+
+    def __init__(self, *args, dn: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dn: str = dn
+        self.data_frame = None
+
+    def compose(self) -> ComposeResult:
+        yield Breadcrumb()
+        yield Footer()
+        yield StatusLine()
+        yield LoadingIndicator(id='loader')
+
+    def on_mount(self):
+        self.app.run_worker(self.load_data, exclusive=True, thread=True)
+
+    def hide_loader(self):
+        self.query_one('#loader').display = False
+
+    def load_data(self):
+        self.query_stats.start_query()
+
+        history_store = HistoryStore(get_history_path(self.settings.cache_dir), self.plugin)
+        try:
+            # syncing loads and extracts the snapshots not yet in the history
+            with self.query_stats.measure('load'):
+                history_store.sync(self.settings.data_dir)
+
+            with self.query_stats.measure('sql'):
+                # DN is matched as is
+                records = history_store.lookup(glob.escape(self.dn))
+        finally:
+            history_store.close()
+
+        self.data_frame = pandas.DataFrame.from_records(records, columns=CHANGE_COLUMNS)
+
+        self.app.call_from_thread(self.render_data)
+
+    async def render_data(self):
+        self.hide_loader()
+
+        if len(self.data_frame) == 0:
+            await self.mount(
+                PlaceholderWidget(text='NO DATA AVAILABLE')
+            )
+            return
+
+        with self.query_stats.measure('render'):
+            frame_view = DataFrameView(
+                id='data',
+                data_frame=self.data_frame,
+                export_dir=self.settings.export_dir,
+            )
+
+            await self.mount(frame_view)
+
+        frame_view.focus()
+
+        self.query_stats.set_result(self.data_frame)
+        self.report_query_stats(self.dn)
@@ -0,0 +1,146 @@
+from typing import Optional
+
+from textual.app import ComposeResult
+from textual.widgets import LoadingIndicator, Footer
+
+from jule.explore.breadcrumb_widget import Breadcrumb
+from jule.explore.common import construct_data_frame_help_text
+from jule.explore.data_frame_view_widget import DataFrameView
+from jule.explore.error_screen import ErrorScreen
+from jule.explore.placeholder_widget import PlaceholderWidget
+from jule.explore.query_picker_screen import QueryPickerScreen
+from jule.explore.screen_base import ScreenBase
+from jule.explore.status_line_widget import StatusLine
+from jule.history import HistoryStore, get_history_path
+from jule.sql import SqlSession, QueryError
+
+QUERY_PICKER_SCREEN_NAME = 'query-picker-for-history-viewer'
+
+
+class HistoryScreen(ScreenBase):
+    TITLE = 'HISTORY'
+
+    BINDINGS = [
+        ('escape', 'back', 'Back'),
+        ('p', "open_picker", 'Query'),
+        ('i', 'entry_history', 'Entry history'),
+    ]
+
+    CSS = """
+#data {
+    width: 100%;
+    height: 100%;
+}
+"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data_frame = None
+        self.sql_session: Optional[SqlSession] = None
+
+    @property
+    def plugin_queries(self):
+        return {
+            q.label: q.query_sql
+            for q in self.plugin.history_screen_queries
+        }
+
+    def compose(self) -> ComposeResult:
+        yield Breadcrumb()
+        yield Footer()
+        yield StatusLine()
+        yield LoadingIndicator(id='loader')
+
+        self.app.install_screen(
+            QueryPickerScreen(
+                queries=self.plugin_queries,
+                explain_fn=self.explain_query,
+            ), name=QUERY_PICKER_SCREEN_NAME
+        )
+
+    def action_open_picker(self):
+        async def check_exit(query: str):
+            await self.render_query(query)
+
+        query_picker_screen: QueryPickerScreen = self.app.get_screen(
+            QUERY_PICKER_SCREEN_NAME)
+
+        if self.data_frame is not None:
+            query_picker_screen.help_text = construct_data_frame_help_text(
+                self.data_frame, accent_color=self.app.get_css_variables()['error'])
+
+        query_picker_screen.update_help_text()
+        self.app.push_screen(QUERY_PICKER_SCREEN_NAME, check_exit)
+
+    def on_mount(self):
+        self.app.run_worker(self.load_data, exclusive=True, thread=True)
+
+    def hide_loader(self):
+        self.query_one('#loader').display = False
+
+    def explain_query(self, query: str) -> str:
+        if self.sql_session is None:
+            raise Exception('Data is not loaded yet')
+        return self.sql_session.explain(query)
+
+    def load_data(self):
+        history_path = get_history_path(self.settings.cache_dir)
+
+        # syncing loads and extracts the snapshots not yet in the history
+        with self.query_stats.measure('load'):
+            history_store = HistoryStore(history_path, self.plugin)
+            try:
+                history_store.sync(self.settings.data_dir)
+            finally:
+                history_store.close()
+
+        self.sql_session = SqlSession(history_path)
+
+        try:
+            # sample of the data to show available columns in the picker
+            self.data_frame = self.sql_session.query('select * from history limit 1000')
+        except QueryError:
+            # no snapshots were ingested at all
+            self.data_frame = None
+
+        self.app.call_from_thread(
+            lambda: self.render_query(list(self.plugin_queries.values())[0])
+        )
+
+    async def render_query(self, query: str):
+        if self.data_frame is None:
+            self.hide_loader()
+            await self.mount(
+                PlaceholderWidget(text='NO DATA AVAILABLE')
+            )
+            return
+
+        self.query_stats.start_query()
+
+        try:
+            with self.query_stats.measure('sql'):
+                result_frame = self.sql_session.query(query)
+        except QueryError as err:
+            self.hide_loader()
+            await self.app.push_screen(
+                ErrorScreen(error_message=str(err)),
+            )
+            return
+
+        self.hide_loader()
+
+        with self.query_stats.measure('render'):
+            await self.query('#data').remove()
+
+            frame_view = DataFrameView(
+                id='data',
+                data_frame=result_frame,
+                export_dir=self.settings.export_dir,
+            )
+
+            await self.mount(frame_view)
+
+        frame_view.focus()
+
+        self.query_stats.set_result(result_frame)
+        self.report_query_stats(query)
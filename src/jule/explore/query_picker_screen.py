@@ -1,7 +1,8 @@
 import copy
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Callable, Optional
 
+from rich.text import Text
 from textual import on
 from textual.app import ComposeResult
 from textual.containers import Container
@@ -18,6 +19,7 @@ class QueryPickerScreen(ModalScreen):
 
     BINDINGS = [
         ('escape', 'app.pop_screen', 'Back'),
+        ('f2', 'explain', 'Explain'),
     ]
 
     CSS = """
@@ -55,8 +57,11 @@ ListView > ListItem {
 }
 """
 
-    def __init__(self, *args, queries: Dict[str, str], **kwargs):
+    def __init__(
+            self, *args, queries: Dict[str, str],
+            explain_fn: Optional[Callable[[str], str]] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.explain_fn = explain_fn
         self.queries = copy.deepcopy(queries)  # mutable
         self.orig_queries = copy.deepcopy(queries)  # immutable
         self.selected_query_name = list(queries.keys())[0]
@@ -110,6 +115,23 @@ ListView > ListItem {
             if self.help_text:
                 container.mount(self.help_text)
 
+    def action_explain(self):
+        if self.explain_fn is None:
+            self.notify('Explain is not supported here', title='EXPLAIN', severity='warning')
+            return
+
+        query = self.query_one('#query', expect_type=TextArea).text
+
+        try:
+            plan = self.explain_fn(query)
+        except Exception as err:
+            self.notify(str(err), title='EXPLAIN', severity='error')
+            return
+
+        container = self.query_one('#help-dock', expect_type=Container)
+        container.remove_children()
+        container.mount(Static(Text.assemble(('QUERY PLAN\n\n', 'bold'), plan)))
+
     @on(ListView.Highlighted)
     def on_query_item_highlighted(self, event: ListView.Highlighted):
         event.stop()
@@ -124,6 +146,9 @@ ListView > ListItem {
 
         self.query_name = query_name
 
+        # drop query plan of the previous query (if any)
+        self.update_help_text()
+
     @on(ListView.Selected)
     def on_query_item_selected(self, event: ListView.Selected):
         event.stop()
@@ -0,0 +1,65 @@
+import contextlib
+import time
+from typing import Dict, Optional
+
+import pandas
+
+from jule.explore.common import human_size
+
+
+class QueryStats:
+    """
+    Timings of the phases the screen goes through to show query results:
+    loading and preparing the data (done once per screen) and running and
+    rendering the query itself (done for every query).
+    """
+
+    DATA_PHASES = ['load', 'extract', 'import']
+    QUERY_PHASES = ['sql', 'render']
+
+    def __init__(self):
+        self.timings_ms: Dict[str, float] = {}
+        self.rows: Optional[int] = None
+        self.result_bytes: Optional[int] = None
+        self.cached: bool = False
+
+    @contextlib.contextmanager
+    def measure(self, phase: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings_ms[phase] = (time.perf_counter() - started_at) * 1000
+
+    def start_query(self):
+        for phase in self.QUERY_PHASES:
+            self.timings_ms.pop(phase, None)
+        self.rows = None
+        self.result_bytes = None
+        self.cached = False
+
+    def set_result(self, result_frame: pandas.DataFrame):
+        self.rows = len(result_frame)
+        self.result_bytes = int(result_frame.memory_usage(deep=True).sum())
+
+    def to_dict(self) -> Dict:
+        return {
+            **{'%s_ms' % phase: round(ms, 1) for phase, ms in self.timings_ms.items()},
+            'rows': self.rows,
+            'result_bytes': self.result_bytes,
+            'cached': self.cached,
+        }
+
+    def format(self) -> str:
+        parts = [
+            '%s %.0f ms' % (phase.upper(), self.timings_ms[phase])
+            for phase in self.DATA_PHASES + self.QUERY_PHASES
+            if phase in self.timings_ms
+        ]
+        if self.rows is not None:
+            parts.append('%d ROWS' % self.rows)
+        if self.result_bytes is not None:
+            parts.append(human_size(self.result_bytes))
+        if self.cached:
+            parts.append('CACHED')
+        return ' · '.join(parts)
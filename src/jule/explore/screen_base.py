@@ -1,12 +1,39 @@
+import json
+import logging
+
 from textual.screen import Screen
 
-from jule.cache import CacheStore
+from jule.cache import CacheStore, QueryResultCache
+from jule.explore.data_frame_view_widget import DataFrameView
+from jule.explore.query_stats import QueryStats
 from jule.explore.settings import AppSettings
-from jule.plugin import PluginBase
+from jule.explore.status_line_widget import StatusLine
+from jule.plugin import PluginBase, PROFILER, is_profiling_enabled
+
+LOGGER = logging.getLogger(__name__)
 
 
 # TODO: how to type hint App w/o introducing a circular references?
 class ScreenBase(Screen):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_stats = QueryStats()
+
+    def report_query_stats(self, query: str):
+        LOGGER.info('query stats: %s', json.dumps(dict(
+            self.query_stats.to_dict(), screen=self.TITLE, query=query)))
+
+        for status_line in self.query(StatusLine):
+            status_line.update(self.query_stats.format())
+
+    def report_progress(self, action: str, done: int, total: int):
+        # called from the worker threads
+        def update():
+            for status_line in self.query(StatusLine):
+                status_line.update('%s: %d of %d' % (action, done, total))
+
+        self.app.call_from_thread(update)
+
     @property
     def settings(self) -> AppSettings:
         return self.app.settings
@@ -18,3 +45,25 @@ class ScreenBase(Screen):
     @property
     def cache_store(self) -> CacheStore:
         return self.app.cache_store
+
+    @property
+    def query_result_cache(self) -> QueryResultCache:
+        return self.app.query_result_cache
+
+    def action_entry_history(self):
+        for frame_view in self.query(DataFrameView):
+            record = frame_view.get_cursor_record()
+            if record is None or not record.get('dn'):
+                self.notify('no DN in the selected row', severity='warning')
+                return
+            self.app.open_entry_history(record['dn'])
+
+    def action_back(self):
+        LOGGER.info('cache counters: %s', json.dumps({
+            'store': self.cache_store.get_counters(),
+            'query_results': self.query_result_cache.store.get_counters(),
+        }))
+        if is_profiling_enabled():
+            LOGGER.info('extraction profile for %s:\n%s', self.TITLE, PROFILER.report())
+            PROFILER.pop_stats()
+        self.app.pop_screen()
@@ -9,7 +9,8 @@ from textual.screen import ModalScreen
 from textual.validation import Validator, ValidationResult
 from textual.widgets import Input, Checkbox, Static
 
-SearchModalScreenResult = namedtuple('SearchScreenResult', ['text', 'is_regex', 'is_case_sensitive'])
+SearchModalScreenResult = namedtuple(
+    'SearchScreenResult', ['text', 'is_regex', 'is_case_sensitive', 'is_fuzzy'])
 
 
 class RegexValidator(Validator):
@@ -58,6 +59,7 @@ class SearchModalScreen(ModalScreen):
             Container(
                 Checkbox('regex', id='is-regex-checkbox'),
                 Checkbox('case-sensitive', id='is-case-sensitive-checkbox'),
+                Checkbox('fuzzy', id='is-fuzzy-checkbox'),
                 id='options-container'
             ),
             Static(
@@ -84,10 +86,21 @@ class SearchModalScreen(ModalScreen):
             input.value += ' '
             input.value = input.value[:-1]
 
+            # similarity is calculated over the plain text only
+            if event.checkbox.value:
+                self.query_one('#is-fuzzy-checkbox').value = False
+
+        elif event.checkbox.id == 'is-fuzzy-checkbox':
+            event.stop()
+
+            if event.checkbox.value:
+                self.query_one('#is-regex-checkbox').value = False
+
     def on_input_submitted(self, event: Input.Submitted):
         input: Input = self.query_one('#input')
         is_regex_checkbox: Checkbox = self.query_one('#is-regex-checkbox')
         is_case_sensitive_checkbox: Checkbox = self.query_one('#is-case-sensitive-checkbox')
+        is_fuzzy_checkbox: Checkbox = self.query_one('#is-fuzzy-checkbox')
 
         if not input.is_valid:
             self.notify('Input is not valid', title='SEARCH', severity='error')
@@ -98,6 +111,7 @@ class SearchModalScreen(ModalScreen):
                 event.input.value,
                 is_regex_checkbox.value,
                 is_case_sensitive_checkbox.value,
+                is_fuzzy_checkbox.value,
             )
         )
 
@@ -1,11 +1,17 @@
+from jule.explore.common import DEFAULT_GRANULARITY, DEFAULT_PICK_STRATEGY
 from jule.plugin import PluginBase
 
 
 class AppSettings:
     def __init__(
             self, data_dir: str, cache_dir: str, export_dir: str,
-            plugin: PluginBase):
+            plugin: PluginBase,
+            timeline_granularity: str = DEFAULT_GRANULARITY,
+            timeline_pick_strategy: str = DEFAULT_PICK_STRATEGY):
         self.data_dir = data_dir
         self.cache_dir = cache_dir
         self.export_dir = export_dir
         self.plugin = plugin
+        # how snapshots are bucketed for the timeline and changes screens
+        self.timeline_granularity = timeline_granularity
+        self.timeline_pick_strategy = timeline_pick_strategy
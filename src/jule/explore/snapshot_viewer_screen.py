@@ -1,7 +1,6 @@
 from typing import Optional
 
 import pandas
-import pandasql
 from textual.app import ComposeResult
 from textual.widgets import (
     Footer,
@@ -17,7 +16,10 @@ from jule.explore.query_picker_screen import (
     QueryPickerScreen,
 )
 from jule.explore.screen_base import ScreenBase
-from jule.state import LdapStorageContainer
+from jule.explore.status_line_widget import StatusLine
+from jule.extract import extract_data_frame
+from jule.sql import SqlSession, QueryError
+from jule.state import LdapStorageContainer, calculate_snapshot_fingerprint
 
 QUERY_PICKER_SCREEN_NAME = 'query-picker-for-snapshot-viewer'
 SEARCH_SCREEN_NAME = 'search-for-snapshot-viewer'
@@ -27,8 +29,9 @@ class SnapshotViewerScreen(ScreenBase):
     TITLE = 'SNAPSHOT VIEWER'
 
     BINDINGS = [
-        ('escape', 'app.pop_screen', 'Back'),
+        ('escape', 'back', 'Back'),
         ('p', "open_picker", 'Query'),
+        ('i', 'entry_history', 'Entry history'),
     ]
 
     CSS = """
@@ -42,6 +45,8 @@ class SnapshotViewerScreen(ScreenBase):
         super().__init__(*args, **kwargs)
         self.ldap_container_path = ldap_container_path
         self.data_frame: Optional[pandas.DataFrame] = None
+        self.sql_session: Optional[SqlSession] = None
+        self.snapshot_fingerprint: Optional[str] = None
 
     @property
     def plugin_queries(self):
@@ -53,6 +58,7 @@ class SnapshotViewerScreen(ScreenBase):
     def compose(self) -> ComposeResult:
         yield Breadcrumb()
         yield Footer()
+        yield StatusLine()
         yield LoadingIndicator(id='loader')
 
     def on_mount(self):
@@ -64,9 +70,14 @@ class SnapshotViewerScreen(ScreenBase):
         self.app.install_screen(
             QueryPickerScreen(
                 queries=self.plugin_queries,
+                explain_fn=self.explain_query,
             ), name=QUERY_PICKER_SCREEN_NAME
         )
 
+    def on_unmount(self):
+        if self.sql_session is not None:
+            self.sql_session.close()
+
     def action_open_picker(self):
         async def check_exit(query: str):
             await self.render_query(query)
@@ -82,6 +93,11 @@ class SnapshotViewerScreen(ScreenBase):
         query_picker_screen.update_help_text()
         self.app.push_screen(QUERY_PICKER_SCREEN_NAME, check_exit)
 
+    def explain_query(self, query: str) -> str:
+        if self.sql_session is None:
+            raise Exception('Data is not loaded yet')
+        return self.sql_session.explain(query)
+
     def hide_loader(self):
         self.query_one('#loader').display = False
 
@@ -89,39 +105,72 @@ class SnapshotViewerScreen(ScreenBase):
         self.query_one('#loader').display = True
 
     def load_data_frame(self):
-        with open(self.ldap_container_path, 'rb') as f:
-            ldap_container = LdapStorageContainer.load(f)
+        default_query = list(self.plugin_queries.values())[0]
 
-        extractor_class = self.settings.plugin.property_extractor_class
+        self.snapshot_fingerprint = calculate_snapshot_fingerprint(self.ldap_container_path)
 
-        ldap_extractor = extractor_class(
-            ldap_container.data,
-        )
+        # cached result of the default query is shown right away, while the
+        # data for further queries is still being loaded
+        cached_frame = self.query_result_cache.get(
+            self.snapshot_fingerprint, self.plugin, default_query)
+
+        if cached_frame is not None:
+            self.query_stats.start_query()
+            self.query_stats.cached = True
+            self.app.call_from_thread(lambda: self.render_frame(cached_frame, default_query))
 
-        records = []
-        for entry_dn in ldap_extractor.entry_by_dn:
-            records.append(dict(
-                ldap_extractor.extract_all(entry_dn),
-                dn=entry_dn)
+        with self.query_stats.measure('load'):
+            with open(self.ldap_container_path, 'rb') as f:
+                ldap_container = LdapStorageContainer.load(f)
+
+        extractor_class = self.settings.plugin.property_extractor_class
+
+        with self.query_stats.measure('extract'):
+            ldap_extractor = extractor_class(
+                ldap_container.data,
             )
 
-        self.data_frame = pandas.DataFrame.from_records(records)
+            self.data_frame = extract_data_frame(ldap_extractor)
+
+        with self.query_stats.measure('import'):
+            self.sql_session = SqlSession()
+            self.sql_session.load_table(
+                'entries', self.data_frame, index_columns=self.plugin.indexed_columns)
 
         # once we loaded the data we render default query
-        self.app.call_from_thread(
-            lambda: self.render_query(
-                list(self.plugin_queries.values())[0],
+        if cached_frame is None:
+            self.app.call_from_thread(
+                lambda: self.render_query(default_query)
             )
-        )
+
+    def run_query(self, query: str) -> pandas.DataFrame:
+        if self.snapshot_fingerprint is not None:
+            # cached result is marked as such instead of being timed as SQL
+            result_frame = self.query_result_cache.get(
+                self.snapshot_fingerprint, self.plugin, query)
+            if result_frame is not None:
+                self.query_stats.cached = True
+                return result_frame
+
+        if self.sql_session is None:
+            raise QueryError('Data is not loaded yet')
+
+        with self.query_stats.measure('sql'):
+            result_frame = self.sql_session.query(query)
+
+        if self.snapshot_fingerprint is not None:
+            self.query_result_cache.set(
+                self.snapshot_fingerprint, self.plugin, query, result_frame)
+
+        return result_frame
 
     async def render_query(self, query: str):
         self.show_loader()
+        self.query_stats.start_query()
 
         try:
-            result_frame = pandasql.sqldf(query, {
-                'entries': self.data_frame,
-            })
-        except pandasql.PandaSQLException as err:
+            result_frame = self.run_query(query)
+        except QueryError as err:
             await self.app.push_screen(
                 ErrorScreen(error_message=str(err)),
             )
@@ -129,16 +178,25 @@ class SnapshotViewerScreen(ScreenBase):
         finally:
             self.hide_loader()
 
-        await self.query('#data').remove()
+        await self.render_frame(result_frame, query)
 
-        frame_view: DataFrameView = DataFrameView(
-            id='data',
-            data_frame=result_frame,
-            export_dir=self.settings.export_dir,
-        )
+    async def render_frame(self, result_frame: pandas.DataFrame, query: str):
+        self.hide_loader()
+
+        with self.query_stats.measure('render'):
+            await self.query('#data').remove()
 
-        self.searcher = DataTableSearcher(frame_view.data_table)
+            frame_view: DataFrameView = DataFrameView(
+                id='data',
+                data_frame=result_frame,
+                export_dir=self.settings.export_dir,
+            )
 
-        await self.mount(frame_view)
+            self.searcher = DataTableSearcher(frame_view.data_table)
+
+            await self.mount(frame_view)
 
         frame_view.focus()
+
+        self.query_stats.set_result(result_frame)
+        self.report_query_stats(query)
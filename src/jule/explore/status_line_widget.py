@@ -0,0 +1,26 @@
+from textual.app import ComposeResult
+from textual.widget import Widget
+from textual.widgets import Static
+
+
+class StatusLine(Widget):
+    DEFAULT_CSS = """
+StatusLine {
+    dock: bottom;
+    height: 1;
+    width: 100%;
+    background: $panel;
+    color: $text-muted;
+    padding: 0 1;
+}
+"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.container = Static()
+
+    def compose(self) -> ComposeResult:
+        yield self.container
+
+    def update(self, text: str):
+        self.container.update(text)
@@ -1,15 +1,17 @@
 import functools
 from typing import List, Dict
 
-import pandasql
 from textual.app import ComposeResult
-from textual.widgets import LoadingIndicator, Footer, Static
+from textual.widgets import LoadingIndicator, Footer
 
+from jule.diff import ADDED, REMOVED
 from jule.explore.breadcrumb_widget import Breadcrumb
 from jule.explore.common import (
     remove_empty_columns,
+    calculate_rollups,
     construct_timeline_data,
-    make_cached_diff_func,
+    make_shared_diff_func,
+    DIFF_RESULT_FUNC,
     construct_data_frame_help_text,
 )
 from jule.explore.data_frame_view_widget import DataFrameView
@@ -17,49 +19,16 @@ from jule.explore.error_screen import ErrorScreen
 from jule.explore.placeholder_widget import PlaceholderWidget
 from jule.explore.query_picker_screen import QueryPickerScreen
 from jule.explore.screen_base import ScreenBase
-from jule.plugin import ExtractorBase
-from jule.state import try_load
+from jule.explore.status_line_widget import StatusLine
+from jule.sql import SqlSession, QueryError
 
 
-def diff(
-        extractor_class: type[ExtractorBase],
-        container_path: str, baseline_path: str) -> List[Dict]:
-    current_container = try_load(container_path, load_data=True)
-    baseline_container = try_load(baseline_path, load_data=True)
-
-    assert current_container is not None
-    assert baseline_container is not None
-
-    current_extractor = extractor_class(current_container.data)
-    baseline_extractor = extractor_class(baseline_container.data)
-
-    baseline_entries = {
-        entry_dn: entry_data
-        for entry_dn, entry_data in baseline_container.data.entries
-    }
-    current_entries = {
-        entry_dn: entry_data
-        for entry_dn, entry_data in current_container.data.entries
-    }
-
-    result = []
-
-    def extract_entry(entry_dn: str, extractor: ExtractorBase):
-        return extractor.extract_all(entry_dn)
-
-    for entry_dn, entry_data in baseline_entries.items():
-        if entry_dn not in current_entries:
-            result.append(dict(
-                extract_entry(entry_dn, baseline_extractor),
-                action='removed'))
-
-    for entry_dn, entry_data in current_entries.items():
-        if entry_dn not in baseline_entries:
-            result.append(dict(
-                extract_entry(entry_dn, current_extractor),
-                action='added'))
-
-    return result
+def diff(diff_fn: DIFF_RESULT_FUNC, container_path: str, baseline_path: str) -> List[Dict]:
+    diff_result = diff_fn(container_path, baseline_path)
+    return (
+        [dict(record, action='removed') for record in diff_result[REMOVED]] +
+        [dict(record, action='added') for record in diff_result[ADDED]]
+    )
 
 
 QUERY_PICKER_SCREEN_NAME = 'query-picker-for-timeline-viewer'
@@ -69,8 +38,9 @@ class TimelineScreen(ScreenBase):
     TITLE = 'TIMELINE'
 
     BINDINGS = [
-        ('escape', 'app.pop_screen', 'Back'),
+        ('escape', 'back', 'Back'),
         ('p', "open_picker", 'Query'),
+        ('i', 'entry_history', 'Entry history'),
     ]
 
     CSS = """
@@ -83,6 +53,7 @@ class TimelineScreen(ScreenBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.data_frame = None
+        self.sql_session = SqlSession()
 
     @property
     def plugin_queries(self):
@@ -94,11 +65,13 @@ class TimelineScreen(ScreenBase):
     def compose(self) -> ComposeResult:
         yield Breadcrumb()
         yield Footer()
+        yield StatusLine()
         yield LoadingIndicator(id='loader')
 
         self.app.install_screen(
             QueryPickerScreen(
                 queries=self.plugin_queries,
+                explain_fn=self.sql_session.explain,
             ), name=QUERY_PICKER_SCREEN_NAME
         )
 
@@ -123,16 +96,34 @@ class TimelineScreen(ScreenBase):
         self.query_one('#loader').display = False
 
     def load_data(self):
-        self.data_frame = construct_timeline_data(
-            self.settings.data_dir,
-            diff_calculation_fn=make_cached_diff_func(
+        # diff functions load and extract snapshots, so that is all "load"
+        with self.query_stats.measure('load'):
+            shared_diff_fn = make_shared_diff_func(self.cache_store, self.plugin)
+            timeline_data = construct_timeline_data(
+                self.settings.data_dir,
+                diff_calculation_fn=functools.partial(diff, shared_diff_fn),
+                prefetch_fn=functools.partial(
+                    shared_diff_fn.prefetch,
+                    progress_fn=functools.partial(self.report_progress, 'diffing snapshots')),
+                granularity=self.settings.timeline_granularity,
+                pick_strategy=self.settings.timeline_pick_strategy,
                 cache_store=self.cache_store,
-                cache_type='timeline',
-                inner_diff_func=functools.partial(
-                    diff,
-                    self.settings.plugin.property_extractor_class,
-                )))
-        self.data_frame = remove_empty_columns(self.data_frame)
+                cache_properties=dict(
+                    shared_diff_fn.key_properties, view='timeline',
+                    rollup_dimensions=','.join(self.plugin.rollup_dimensions)),
+                rollup_fn=functools.partial(
+                    calculate_rollups,
+                    dimensions=self.plugin.rollup_dimensions,
+                    group_columns=['action']),
+            )
+
+        self.data_frame = remove_empty_columns(timeline_data.data_frame)
+
+        if len(self.data_frame) != 0:
+            with self.query_stats.measure('import'):
+                self.sql_session.load_table(
+                    'entries', self.data_frame, index_columns=self.plugin.indexed_columns)
+                self.sql_session.load_table('rollups', timeline_data.rollups)
 
         self.app.call_from_thread(
             lambda: self.render_query(list(self.plugin_queries.values())[0])
@@ -148,26 +139,32 @@ class TimelineScreen(ScreenBase):
             )
             return
 
+        self.query_stats.start_query()
+
         try:
-            result_frame = pandasql.sqldf(query, {
-                'entries': self.data_frame,
-            })
-        except pandasql.PandaSQLException as err:
+            with self.query_stats.measure('sql'):
+                result_frame = self.sql_session.query(query)
+        except QueryError as err:
             self.hide_loader()
             await self.app.push_screen(
                 ErrorScreen(error_message=str(err)),
             )
             return
 
-        await self.query('#data').remove()
+        self.hide_loader()
 
-        frame_view = DataFrameView(
-            id='data',
-            data_frame=result_frame,
-            export_dir=self.settings.export_dir,
-        )
+        with self.query_stats.measure('render'):
+            await self.query('#data').remove()
 
-        self.hide_loader()
-        await self.mount(frame_view)
+            frame_view = DataFrameView(
+                id='data',
+                data_frame=result_frame,
+                export_dir=self.settings.export_dir,
+            )
+
+            await self.mount(frame_view)
 
         frame_view.focus()
+
+        self.query_stats.set_result(result_frame)
+        self.report_query_stats(query)
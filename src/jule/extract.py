@@ -0,0 +1,188 @@
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.forkserver
+import os
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
+
+import pandas
+
+from jule.plugin import ExtractorBase, PROFILER, is_profiling_enabled
+from jule.state import LdapSnapshotData
+
+LOGGER = logging.getLogger(__name__)
+
+# below this amount of entries the overhead of spinning up worker processes
+# outweighs the gain, so extraction happens in the calling thread
+PARALLEL_THRESHOLD = 20000
+CHUNK_SIZE = 5000
+
+WORKERS_ENV_VAR = 'JULE_EXTRACT_WORKERS'
+
+
+def get_default_workers_count() -> int:
+    # pools diffing the snapshot pairs (every worker loads its snapshots)
+    return int(os.environ.get(WORKERS_ENV_VAR) or os.cpu_count() or 1)
+
+
+def get_extract_workers_count() -> int:
+    # shipping entries to the workers and records back costs about as much
+    # as extracting the usual (cheap) properties, so it is opt-in
+    return int(os.environ.get(WORKERS_ENV_VAR) or 1)
+
+
+def get_pool_context() -> Optional[multiprocessing.context.BaseContext]:
+    """
+    Pools are started from the threads (e.g. explorer workers) and a process
+    forked from them might inherit locks held by the other threads (logging,
+    profiler), so workers are forked by a clean server process instead where
+    supported (platform default otherwise, i.e. spawn).
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    # modules every worker needs are imported by the server just once
+    context.set_forkserver_preload(['jule.extract', 'jule.diff'])
+    return context
+
+
+def start_pool_server():
+    """
+    Starts the server workers are forked from in advance, which is needed
+    when standard streams get replaced later on (e.g. by the TUI), as the
+    server inherits the stderr.
+    """
+    if get_pool_context() is not None:
+        multiprocessing.forkserver.ensure_running()
+
+
+def _extract_chunk(
+        extractor_class: type[ExtractorBase], entries: List[Tuple[str, dict]],
+        dns: List[str], properties: Optional[List[str]],
+        skip_missing: bool, include_dn: bool):
+    # extractor over the chunk entries and the ones they refer to
+    extractor = extractor_class(LdapSnapshotData(entries))
+    records = _extract_serial(extractor, dns, properties, skip_missing, include_dn)
+    # profiling stats collected by the worker are shipped back to be merged
+    # into the profiler of the parent process
+    profile_stats = PROFILER.pop_stats() if is_profiling_enabled() else None
+    return records, profile_stats
+
+
+def _extract_serial(
+        extractor: ExtractorBase, dns: Iterable[str], properties: Optional[List[str]],
+        skip_missing: bool, include_dn: bool) -> List[Dict]:
+    records = []
+    for entry_dn in dns:
+        if properties is None:
+            record = extractor.extract_all(entry_dn, skip_missing=skip_missing)
+        else:
+            record = {
+                prop: extractor.extract(entry_dn, prop)
+                for prop in properties
+            }
+        if include_dn:
+            record['dn'] = entry_dn
+        records.append(record)
+    return records
+
+
+def get_chunk_entries(
+        extractor: ExtractorBase, dns: List[str]) -> Optional[List[Tuple[str, dict]]]:
+    # None when the plugin does not know what entries properties refer to
+    chunk_dns = dict.fromkeys(dns)
+    for entry_dn in dns:
+        referenced_dns = extractor.get_referenced_dns(entry_dn)
+        if referenced_dns is None:
+            return None
+        chunk_dns.update(dict.fromkeys(
+            referenced_dn for referenced_dn in referenced_dns
+            if referenced_dn in extractor.entry_by_dn))
+    return [
+        (entry_dn, extractor.entry_by_dn[entry_dn])
+        for entry_dn in chunk_dns
+        if entry_dn in extractor.entry_by_dn
+    ]
+
+
+def iter_records(
+        extractor: ExtractorBase,
+        dns: Optional[Iterable[str]] = None,
+        properties: Optional[List[str]] = None,
+        skip_missing: bool = False,
+        include_dn: bool = False,
+        workers: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Extracts properties for given DNs (all the entries when not specified)
+    preserving the order. When there are many entries the work is split into
+    chunks processed by a pool of worker processes. Records are yielded as
+    soon as the chunk they belong to is ready.
+
+    Pool is used only when requested (see JULE_EXTRACT_WORKERS) and when the
+    plugin tells which entries the properties refer to, as every worker gets
+    only the entries of its chunk along with the referenced ones.
+    """
+    dns = list(dns) if dns is not None else list(extractor.entry_by_dn)
+    workers = workers or get_extract_workers_count()
+
+    if workers <= 1 or len(dns) < PARALLEL_THRESHOLD:
+        yield from _extract_serial(extractor, dns, properties, skip_missing, include_dn)
+        return
+
+    chunks = [dns[idx:idx + CHUNK_SIZE] for idx in range(0, len(dns), CHUNK_SIZE)]
+    chunk_entries = [get_chunk_entries(extractor, chunk) for chunk in chunks]
+
+    if any(entries is None for entries in chunk_entries):
+        LOGGER.debug('referenced entries are not known -> extracting serially')
+        yield from _extract_serial(extractor, dns, properties, skip_missing, include_dn)
+        return
+
+    workers = min(workers, len(chunks))
+
+    LOGGER.debug(
+        'extracting %d entries in %d chunks using %d workers...',
+        len(dns), len(chunks), workers)
+
+    def collect(future: concurrent.futures.Future) -> List[Dict]:
+        chunk_records, profile_stats = future.result()
+        if profile_stats:
+            PROFILER.merge(profile_stats)
+        return chunk_records
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_pool_context()) as executor:
+        # limited amount of chunks is in flight, so that results do not pile
+        # up in memory when consumer is slower than the workers
+        pending = collections.deque()
+        for chunk, entries in zip(chunks, chunk_entries):
+            pending.append(executor.submit(
+                _extract_chunk, type(extractor), entries, chunk,
+                properties, skip_missing, include_dn))
+            if len(pending) >= workers * 2:
+                yield from collect(pending.popleft())
+        while pending:
+            yield from collect(pending.popleft())
+
+
+def extract_records(
+        extractor: ExtractorBase,
+        dns: Optional[Iterable[str]] = None,
+        properties: Optional[List[str]] = None,
+        skip_missing: bool = False,
+        include_dn: bool = False,
+        workers: Optional[int] = None) -> List[Dict]:
+    return list(iter_records(
+        extractor, dns, properties=properties, skip_missing=skip_missing,
+        include_dn=include_dn, workers=workers))
+
+
+def extract_data_frame(
+        extractor: ExtractorBase,
+        dns: Optional[Iterable[str]] = None,
+        properties: Optional[List[str]] = None,
+        workers: Optional[int] = None) -> pandas.DataFrame:
+    records = extract_records(
+        extractor, dns, properties=properties, include_dn=True, workers=workers)
+    return pandas.DataFrame.from_records(records)
@@ -0,0 +1,435 @@
+import datetime
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Callable, Set, Tuple
+
+from jule.common import fully_qualified_class_name
+from jule.diff import ADDED, REMOVED, CHANGED, decode_raw_value
+from jule.extract import extract_records
+from jule.name_index import compile_glob, glob_literal, glob_literal_segments, normalize, trigrams
+from jule.plugin import PluginBase
+from jule.state import LdapSnapshotMetadata, try_load
+
+LOGGER = logging.getLogger(__name__)
+
+HISTORY_FILENAME = 'history.sqlite'
+
+# columns every history row has regardless of the plugin
+KEY_COLUMNS = ['snapshot_ts', 'label', 'dn']
+STABLE_ID_COLUMN = 'stable_id'
+
+# entry which got another DN (but kept the stable id)
+RENAMED = 'renamed'
+
+CHANGE_COLUMNS = [
+    'snapshot_ts', 'label', 'dn', 'action', 'old_dn', 'updated_props', 'details', 'stable_id',
+]
+
+# properties (besides DN) entries are looked up by
+LOOKUP_PROPERTIES = ['full_name']
+
+# amount of stable ids looked up by a single statement
+LOOKUP_CHUNK_SIZE = 500
+
+# sorts after any other character, so that [prefix, prefix + it) range
+# has every name starting with the prefix
+MAX_CHAR = '\U0010ffff'
+
+# concurrent syncs (e.g. several explorers sharing the cache dir) wait for
+# each other that long instead of failing with "database is locked"
+LOCK_TIMEOUT_SECONDS = 300
+
+# stable id -> (dn, property values)
+SnapshotState = Dict[str, Tuple[str, tuple]]
+
+
+def get_history_path(cache_dir: str) -> str:
+    return os.path.join(cache_dir, HISTORY_FILENAME)
+
+
+def format_snapshot_ts(timestamp: float) -> str:
+    # UTC, so that snapshots taken around DST switch get distinct keys
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def get_stable_id(entry_dn: str, entry: Dict, attributes: List[str]) -> str:
+    for attr in attributes:
+        values = entry.get(attr)
+        if values:
+            return '%s:%s' % (attr, decode_raw_value(values[0]))
+    # renames can not be tracked without the stable id attribute
+    return 'dn:' + entry_dn.lower()
+
+
+def calculate_change_records(
+        current: SnapshotState, previous: SnapshotState,
+        property_columns: List[str]) -> List[tuple]:
+    """
+    Compares states of two snapshots by stable id, returns rows of the
+    "changes" table (except snapshot_ts and label). Only the updated
+    properties are recorded along with their old and new values.
+    """
+    records = []
+
+    for stable_id, (entry_dn, values) in current.items():
+        if stable_id not in previous:
+            records.append((entry_dn, ADDED, None, None, None, stable_id))
+            continue
+
+        old_dn, old_values = previous[stable_id]
+        updated = {
+            prop: [old_value, value]
+            for prop, old_value, value in zip(property_columns, old_values, values)
+            if old_value != value
+        }
+
+        if old_dn != entry_dn:
+            action = RENAMED
+        elif updated:
+            action = CHANGED
+        else:
+            continue
+
+        records.append((
+            entry_dn, action, old_dn if action == RENAMED else None,
+            ', '.join(updated) or None,
+            json.dumps(updated, default=str) if updated else None,
+            stable_id,
+        ))
+
+    for stable_id, (old_dn, _) in previous.items():
+        if stable_id not in current:
+            records.append((old_dn, REMOVED, None, None, None, stable_id))
+
+    return records
+
+
+class HistoryStore:
+    """
+    Persistent SQLite database with "history" table which holds properties of
+    every entry from every snapshot ever seen. Snapshots are ingested
+    incrementally, only the ones not yet known are extracted on sync.
+
+    Table is clustered by (snapshot_ts, label, dn) primary key, so filters by
+    time range read only the relevant snapshots (partitions) of the table.
+
+    Besides that, "changes" table keeps compact records of what happened to
+    every entry (keyed by the stable id, so renames are tracked) between
+    the adjacent snapshots of the same label, and "names" table maps DNs and
+    names ever seen to the stable ids, so that history of an entry is looked
+    up without reading the snapshots. Names are clustered by the lower-cased
+    name (exact and prefix lookups are index seeks), "name_trigrams" table
+    narrows down infix patterns.
+
+    Files already seen are recorded along with their size and modification
+    time, so that sync does not open them again.
+    """
+
+    # increment when layout of the database changes
+    SCHEMA_VERSION = 5
+
+    def __init__(self, path: str, plugin: PluginBase):
+        self.path: str = path
+        self.plugin: PluginBase = plugin
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=LOCK_TIMEOUT_SECONDS, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.ensure_schema()
+
+    @property
+    def fingerprint(self) -> str:
+        return '%s:%s:%s' % (
+            self.SCHEMA_VERSION,
+            fully_qualified_class_name(type(self.plugin)),
+            self.plugin.version,
+        )
+
+    def ensure_schema(self):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = self.connection.execute(
+                'SELECT value FROM meta WHERE key = ?', ('fingerprint',)).fetchone()
+
+            if row is not None and row[0] != self.fingerprint:
+                LOGGER.warning('history was built by another plugin/version -> rebuilding')
+                self.connection.execute('DROP TABLE IF EXISTS history')
+                self.connection.execute('DROP TABLE IF EXISTS snapshots')
+                self.connection.execute('DROP TABLE IF EXISTS changes')
+                self.connection.execute('DROP TABLE IF EXISTS names')
+                self.connection.execute('DROP TABLE IF EXISTS name_trigrams')
+                self.connection.execute('DROP TABLE IF EXISTS files')
+
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'snapshot_ts TEXT, label TEXT, path TEXT, entries_count INTEGER, '
+                'PRIMARY KEY (snapshot_ts, label))')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS changes (%s, '
+                'PRIMARY KEY (stable_id, snapshot_ts, label)) WITHOUT ROWID' % (
+                    ', '.join(CHANGE_COLUMNS)))
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_changes_snapshot ON changes (snapshot_ts, label)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS names (name_lower TEXT, name TEXT, stable_id TEXT, '
+                'PRIMARY KEY (name_lower, name, stable_id)) WITHOUT ROWID')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS name_trigrams (trigram TEXT, name_lower TEXT, '
+                'PRIMARY KEY (trigram, name_lower)) WITHOUT ROWID')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)')
+            self.connection.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                ('fingerprint', self.fingerprint))
+
+    def ensure_history_table(self, property_columns: List[str]):
+        # columns depend on the plugin properties, so the table is created
+        # once the first snapshot gets ingested
+        columns = KEY_COLUMNS + [STABLE_ID_COLUMN] + property_columns
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS history (%s, PRIMARY KEY (%s)) WITHOUT ROWID' % (
+                ', '.join('"%s"' % column for column in columns),
+                ', '.join(KEY_COLUMNS),
+            ))
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS ix_history_dn ON history (dn, snapshot_ts)')
+
+    def load_snapshot_state(
+            self, snapshot_ts: str, label: Optional[str],
+            property_columns: List[str]) -> SnapshotState:
+        cursor = self.connection.execute(
+            'SELECT dn, stable_id, %s FROM history WHERE snapshot_ts = ? AND label IS ?' % (
+                ', '.join('"%s"' % column for column in property_columns)),
+            (snapshot_ts, label))
+        return {
+            stable_id: (entry_dn, tuple(values))
+            for entry_dn, stable_id, *values in cursor
+        }
+
+    def update_changes(self, snapshot_ts: str, label: Optional[str], property_columns: List[str]):
+        # compared with the previous snapshot of the same label, the very
+        # first one has everything "added"
+        previous_ts, = self.connection.execute(
+            'SELECT max(snapshot_ts) FROM snapshots WHERE label IS ? AND snapshot_ts < ?',
+            (label, snapshot_ts)).fetchone()
+
+        current = self.load_snapshot_state(snapshot_ts, label, property_columns)
+        previous = (
+            self.load_snapshot_state(previous_ts, label, property_columns)
+            if previous_ts is not None else {}
+        )
+
+        records = calculate_change_records(current, previous, property_columns)
+
+        self.connection.execute(
+            'DELETE FROM changes WHERE snapshot_ts = ? AND label IS ?', (snapshot_ts, label))
+        self.connection.executemany(
+            'INSERT INTO changes (%s) VALUES (%s)' % (
+                ', '.join(CHANGE_COLUMNS), ', '.join('?' for _ in CHANGE_COLUMNS)),
+            [(snapshot_ts, label) + record for record in records])
+
+    def is_ingested(self, metadata: LdapSnapshotMetadata) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT 1 FROM snapshots WHERE snapshot_ts = ? AND label IS ?',
+                (format_snapshot_ts(metadata.timestamp), metadata.label)).fetchone()
+            return row is not None
+
+    def ingest(self, path: str):
+        container = try_load(path, load_data=True)
+
+        if container is None:
+            raise Exception('unable to load "%s"' % path)
+
+        snapshot_ts = format_snapshot_ts(container.metadata.timestamp)
+        label = container.metadata.label
+
+        LOGGER.info('ingesting "%s" into history...', path)
+        extractor = self.plugin.property_extractor_class(container.data)
+        dns = list(extractor.entry_by_dn)
+        property_columns = [
+            prop for prop in extractor.get_all_property_names()
+            if prop not in KEY_COLUMNS
+        ]
+        records = extract_records(extractor, dns, properties=property_columns)
+        stable_ids = [
+            get_stable_id(entry_dn, extractor.entry_by_dn[entry_dn], self.plugin.stable_id_attributes)
+            for entry_dn in dns
+        ]
+
+        rows = [
+            [snapshot_ts, label, entry_dn, stable_id] + [record[prop] for prop in property_columns]
+            for entry_dn, stable_id, record in zip(dns, stable_ids, records)
+        ]
+
+        names = set(zip(dns, stable_ids))
+        for prop in LOOKUP_PROPERTIES:
+            if prop in property_columns:
+                names.update(
+                    (record[prop], stable_id)
+                    for stable_id, record in zip(stable_ids, records)
+                    if record[prop]
+                )
+
+        columns = KEY_COLUMNS + [STABLE_ID_COLUMN] + property_columns
+
+        with self.lock, self.connection:
+            self.ensure_history_table(property_columns)
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO history (%s) VALUES (%s)' % (
+                    ', '.join('"%s"' % column for column in columns),
+                    ', '.join('?' for _ in columns)),
+                rows)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                (snapshot_ts, label, os.path.abspath(path), len(rows)))
+            self.insert_names(names)
+            self.remember_file(path)
+
+            self.update_changes(snapshot_ts, label, property_columns)
+
+            # snapshot older than the latest one changes what happened in
+            # the next snapshot as well
+            next_ts, = self.connection.execute(
+                'SELECT min(snapshot_ts) FROM snapshots WHERE label IS ? AND snapshot_ts > ?',
+                (label, snapshot_ts)).fetchone()
+            if next_ts is not None:
+                self.update_changes(next_ts, label, property_columns)
+
+    def insert_names(self, names: Set[Tuple[str, str]]):
+        # trigrams are only added for the names not seen before
+        new_names = {
+            name_lower for name_lower in {normalize(name) for name, _ in names}
+            if self.connection.execute(
+                'SELECT 1 FROM names WHERE name_lower = ? LIMIT 1', (name_lower,)).fetchone() is None
+        }
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO names VALUES (?, ?, ?)',
+            ((normalize(name), name, stable_id) for name, stable_id in names))
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO name_trigrams VALUES (?, ?)',
+            ((trigram, name_lower) for name_lower in new_names for trigram in trigrams(name_lower)))
+
+    def remember_file(self, path: str):
+        stat = os.stat(path)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+            (os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+
+    def sync(
+            self, data_dir: str,
+            filter: Optional[Callable[[LdapSnapshotMetadata], bool]] = None) -> int:
+        """
+        Ingests snapshots from the data directory which are not yet in the
+        history, returns amount of ingested snapshots. Files which did not
+        change since the last sync are not opened.
+        """
+        with self.lock:
+            known_files = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self.connection.execute(
+                    'SELECT path, size, mtime_ns FROM files')
+            }
+
+        ingested = 0
+        for dir_path, dir_names, file_names in os.walk(data_dir):
+            for file_name in sorted(file_names):
+                path = os.path.abspath(os.path.join(dir_path, file_name))
+                stat = os.stat(path)
+
+                if known_files.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                container = try_load(path, load_data=False)
+
+                if container is not None and filter and not filter(container.metadata):
+                    continue
+
+                if container is not None and not self.is_ingested(container.metadata):
+                    self.ingest(path)
+                    ingested += 1
+                    continue
+
+                # either not a snapshot or ingested from another path
+                with self.lock, self.connection:
+                    self.remember_file(path)
+
+        LOGGER.info('history synced, %d new snapshot(s) ingested', ingested)
+        return ingested
+
+    def find_stable_ids(self, pattern: str) -> List[str]:
+        """
+        Returns stable ids of the entries DN or name of which ever matched
+        given glob pattern (or which have the pattern as the stable id).
+        """
+        literal = glob_literal(pattern)
+
+        with self.lock:
+            if literal is not None:
+                stable_ids = [
+                    stable_id for stable_id, in self.connection.execute(
+                        'SELECT stable_id FROM names WHERE name_lower = ?', (normalize(literal),))
+                ]
+                is_stable_id = self.connection.execute(
+                    'SELECT 1 FROM changes WHERE stable_id = ? LIMIT 1', (literal,)).fetchone()
+                if is_stable_id:
+                    stable_ids.append(literal)
+                return list(dict.fromkeys(stable_ids))
+
+            prefix, segments = glob_literal_segments(normalize(pattern))
+            pattern_trigrams = sorted(set().union(*map(trigrams, segments)))
+
+            if prefix:
+                cursor = self.connection.execute(
+                    'SELECT name, stable_id FROM names WHERE name_lower >= ? AND name_lower < ?',
+                    (prefix, prefix + MAX_CHAR))
+            elif pattern_trigrams:
+                cursor = self.connection.execute(
+                    'SELECT name, stable_id FROM names WHERE name_lower IN (%s)' % ' INTERSECT '.join(
+                        'SELECT name_lower FROM name_trigrams WHERE trigram = ?'
+                        for _ in pattern_trigrams),
+                    pattern_trigrams)
+            else:
+                cursor = self.connection.execute('SELECT name, stable_id FROM names')
+
+            matches = compile_glob(pattern)
+            return list(dict.fromkeys(
+                stable_id for name, stable_id in cursor
+                if matches(name)
+            ))
+
+    def get_changes(self, stable_ids: List[str]) -> List[Dict]:
+        """
+        Returns change records of the given entries ordered by time.
+        """
+        records = []
+        with self.lock:
+            for idx in range(0, len(stable_ids), LOOKUP_CHUNK_SIZE):
+                chunk = stable_ids[idx:idx + LOOKUP_CHUNK_SIZE]
+                cursor = self.connection.execute(
+                    'SELECT %s FROM changes WHERE stable_id IN (%s)' % (
+                        ', '.join(CHANGE_COLUMNS), ', '.join('?' for _ in chunk)),
+                    chunk)
+                records.extend(dict(zip(CHANGE_COLUMNS, row)) for row in cursor)
+
+        records.sort(key=lambda r: (r['snapshot_ts'], r['label'] or '', r['dn']))
+        return records
+
+    def lookup(self, pattern: str) -> List[Dict]:
+        """
+        Returns change records of all the entries DN or name of which ever
+        matched given glob pattern, ordered by time.
+        """
+        stable_ids = self.find_stable_ids(pattern)
+        LOGGER.debug('%d entries match "%s"', len(stable_ids), pattern)
+        return self.get_changes(stable_ids)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
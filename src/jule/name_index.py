@@ -0,0 +1,197 @@
+import bisect
+import collections
+import fnmatch
+import functools
+import re
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# characters starting a wildcard in glob patterns
+GLOB_SPECIAL_CHARS = '*?['
+
+
+# matches the whole text (glob) or its part (search)
+TextMatcher = Callable[[str], bool]
+
+
+def normalize(text: str) -> str:
+    # full case folding ("Straße" is "strasse"); dotted capital I folds to
+    # "i" with the combining dot above, which is dropped so that it matches
+    # plain "i" as case-insensitive regex does
+    return text.casefold().replace('i\u0307', 'i')
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_glob(pattern: str, case_sensitive: bool = False) -> TextMatcher:
+    # case-insensitive pattern is matched in the normalized form, the one
+    # the index keeps texts in
+    if case_sensitive:
+        regex = re.compile(fnmatch.translate(pattern))
+        return lambda text: regex.fullmatch(text) is not None
+    regex = re.compile(fnmatch.translate(normalize(pattern)))
+    return lambda text: regex.fullmatch(normalize(text)) is not None
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_search(text: str, is_regex: bool = False, case_sensitive: bool = False) -> TextMatcher:
+    if is_regex:
+        # regex itself can not be normalized (e.g. "\S" would become "\s"),
+        # so case is ignored by the flag
+        regex = re.compile(text, flags=0 if case_sensitive else re.IGNORECASE)
+        return lambda value: regex.search(value) is not None
+    if case_sensitive:
+        return lambda value: text in value
+    text = normalize(text)
+    return lambda value: text in normalize(value)
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[idx:idx + 3] for idx in range(len(text) - 2)}
+
+
+def glob_literal_segments(pattern: str) -> Tuple[str, List[str]]:
+    """
+    Returns literal prefix of the glob pattern and all its literal segments
+    (parts between the wildcards).
+    """
+    segments = []
+    buffer = ''
+    prefix = None
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char in GLOB_SPECIAL_CHARS:
+            if prefix is None:
+                prefix = buffer
+            if buffer:
+                segments.append(buffer)
+            buffer = ''
+            if char == '[':
+                # skip the whole character class
+                closing_idx = pattern.find(']', idx + 2)
+                idx = closing_idx if closing_idx != -1 else len(pattern)
+        else:
+            buffer += char
+        idx += 1
+    if buffer:
+        segments.append(buffer)
+    return (buffer if prefix is None else prefix), segments
+
+
+def glob_literal(pattern: str) -> Optional[str]:
+    """
+    Returns the only text glob pattern matches (escaped wildcards, like
+    produced by glob.escape, included) or None if it has real wildcards.
+    """
+    literal = ''
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == '[' and pattern[idx + 1:idx + 2] not in ('', '!') and pattern[idx + 2:idx + 3] == ']':
+            literal += pattern[idx + 1]
+            idx += 3
+            continue
+        if char in GLOB_SPECIAL_CHARS:
+            return None
+        literal += char
+        idx += 1
+    return literal
+
+
+class NameIndex:
+    """
+    Index over the texts (e.g. full names) of the keyed items (e.g. DNs):
+    normalized texts are kept in a sorted array to resolve prefix globs with
+    a binary search, and trigram posting lists narrow down candidates for
+    infix and fuzzy patterns, so that only few texts are matched for real.
+    """
+
+    def __init__(self, items: Iterable[Tuple[Hashable, Optional[str]]]):
+        entries = sorted(
+            (normalize(text), text, key)
+            for key, text in items
+            if text
+        )
+        self.names: List[str] = [name for name, _, _ in entries]
+        self.texts: List[str] = [text for _, text, _ in entries]
+        self.keys: List[Hashable] = [key for _, _, key in entries]
+        self.postings: Dict[str, List[int]] = collections.defaultdict(list)
+        for position, name in enumerate(self.names):
+            for trigram in trigrams(name):
+                self.postings[trigram].append(position)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix_range(self, prefix: str) -> range:
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_left(self.names, prefix + '\U0010ffff', lo=lo)
+        return range(lo, hi)
+
+    def trigram_candidates(self, segments: List[str]) -> Optional[Set[int]]:
+        # None means trigrams can not narrow anything down
+        candidates = None
+        for segment in segments:
+            for trigram in trigrams(segment):
+                positions = set(self.postings.get(trigram, ()))
+                candidates = positions if candidates is None else candidates & positions
+                if not candidates:
+                    return candidates
+        return candidates
+
+    def match_glob(self, pattern: str, case_sensitive: bool = False) -> List[Hashable]:
+        prefix, segments = glob_literal_segments(normalize(pattern))
+        matches = compile_glob(pattern, case_sensitive)
+
+        if prefix:
+            candidates = self.prefix_range(prefix)
+        else:
+            candidates = self.trigram_candidates(segments)
+            if candidates is None:
+                candidates = range(len(self.names))
+            candidates = sorted(candidates)
+
+        return [
+            self.keys[position] for position in candidates
+            if matches(self.texts[position])
+        ]
+
+    def search(self, text: str, case_sensitive: bool = False) -> List[Hashable]:
+        """
+        Returns keys of items containing given text.
+        """
+        candidates = self.trigram_candidates([normalize(text)])
+        if candidates is None:
+            candidates = range(len(self.names))
+        matches = compile_search(text, case_sensitive=case_sensitive)
+        return [
+            self.keys[position] for position in sorted(candidates)
+            if matches(self.texts[position])
+        ]
+
+    def search_fuzzy(
+            self, text: str, limit: int = 10,
+            min_similarity: float = 0.3) -> List[Tuple[Hashable, float]]:
+        """
+        Returns keys of items most similar to the given text along with the
+        similarity (share of the common trigrams).
+        """
+        query_trigrams = trigrams(normalize(text))
+        if not query_trigrams:
+            return []
+
+        shared = collections.Counter()
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+
+        scored = []
+        for position, count in shared.items():
+            name_trigrams_count = max(len(self.names[position]) - 2, 0)
+            similarity = count / (len(query_trigrams) + name_trigrams_count - count)
+            if similarity >= min_similarity:
+                scored.append((similarity, position))
+
+        scored.sort(key=lambda t: (-t[0], t[1]))
+        return [
+            (self.keys[position], similarity)
+            for similarity, position in scored[:limit]
+        ]
@@ -9,6 +9,11 @@ from .base import (
     ScreenQuery,
     load_from_module,
 )
+from .profiler import (
+    PROFILER,
+    enable_profiling,
+    is_profiling_enabled,
+)
 
 
 def get_default_plugin_class_name():
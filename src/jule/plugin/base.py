@@ -1,8 +1,10 @@
 import abc
 import logging
+import time
 import typing
 import importlib
 
+from jule.plugin.profiler import PROFILER, is_profiling_enabled
 from jule.state import LdapSnapshotData
 
 LOGGER = logging.getLogger(__name__)
@@ -35,6 +37,18 @@ class ExtractorBase(abc.ABC):
             in snapshot.entries
         }
 
+        # profiling mode shadows "extract" with the timed version, so that
+        # the calls plugin makes internally are accounted for as well
+        if is_profiling_enabled():
+            self.extract = self._profiled_extract
+
+    def _profiled_extract(self, dn: str, prop: str):
+        started_at = time.perf_counter()
+        try:
+            return type(self).extract(self, dn, prop)
+        finally:
+            PROFILER.record(prop, dn, time.perf_counter() - started_at)
+
     def extract_all(self, dn: str, skip_missing=False):
         properties = self.get_all_property_names()
         data = {}
@@ -45,6 +59,15 @@ class ExtractorBase(abc.ABC):
             data[prop_name] = prop_value
         return data
 
+    def get_referenced_dns(self, dn: str) -> list[str] | None:
+        """
+        Returns DNs of other entries the properties of the given one are
+        derived from (e.g. manager name), so that changes of those make the
+        entry changed as well. None means it is unknown and every entry has
+        to be extracted when diffing the snapshots.
+        """
+        return None
+
     @abc.abstractmethod
     def get_all_property_names(self) -> list[str]:
         pass
@@ -81,14 +104,64 @@ class PluginBase(abc.ABC):
         return [
             ScreenQuery('LIGHT', 'select dn, full_name, updated_props from changes'),
             ScreenQuery('ALL', 'select * from changes'),
+            ScreenQuery('RAW', 'select * from raw_changes'),
+            ScreenQuery('CHANGES BY DEPARTMENT', (
+                'select bucket_key, updated_prop, value as department, count\n'
+                'from rollups\n'
+                'where dimension = \'department\'\n'
+                'order by bucket_key, updated_prop, department')),
         ]
 
     @property
     def timeline_screen_queries(self) -> list[ScreenQuery]:
         return [
-            ScreenQuery('ALL', 'select * from entries')
+            ScreenQuery('ALL', 'select * from entries'),
+            ScreenQuery('CHURN BY DEPARTMENT', (
+                'select bucket_key, value as department,\n'
+                '  sum(case when action = \'added\' then count else 0 end) as hires,\n'
+                '  sum(case when action = \'removed\' then count else 0 end) as leavers\n'
+                'from rollups\n'
+                'where dimension = \'department\'\n'
+                'group by bucket_key, value\n'
+                'order by bucket_key, department')),
+        ]
+
+    @property
+    def history_screen_queries(self) -> list[ScreenQuery]:
+        return [
+            ScreenQuery('HEADCOUNT', (
+                'select snapshot_ts, label, count(*) as headcount\n'
+                'from history\n'
+                'group by snapshot_ts, label\n'
+                'order by snapshot_ts')),
+            ScreenQuery('DEPARTMENT CHANGES', (
+                'select * from (\n'
+                '  select snapshot_ts, dn, full_name, department,\n'
+                '    lag(department) over (partition by dn order by snapshot_ts) as old_department\n'
+                '  from history\n'
+                ')\n'
+                'where department is not old_department and old_department is not null')),
+            ScreenQuery('ALL', 'select * from history'),
         ]
 
+    @property
+    def stable_id_attributes(self) -> list[str]:
+        # attributes which identify the entry regardless of its DN, the
+        # first one present is used to track renames in the history
+        return ['entryUUID', 'objectGUID']
+
+    @property
+    def rollup_dimensions(self) -> list[str]:
+        # properties timeline and changes are pre-aggregated by (see
+        # "rollups" table), so that churn per e.g. department is cheap to get
+        return ['department', 'title']
+
+    @property
+    def indexed_columns(self) -> list[str]:
+        # columns SQL sessions create indexes for (whenever table has them),
+        # so that filtering and self-joins by them do not scan whole table
+        return ['dn', 'manager_dn', 'department', 'updated_props', 'attribute']
+
     @property
     @abc.abstractmethod
     def version(self):
@@ -0,0 +1,89 @@
+import heapq
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import tabulate
+
+PROFILING_ENV_VAR = 'JULE_PROFILE_EXTRACTION'
+
+
+def is_profiling_enabled() -> bool:
+    return os.environ.get(PROFILING_ENV_VAR, '').lower() in ('1', 'true', 'yes')
+
+
+def enable_profiling():
+    # environment is used instead of a module level flag, so that the setting
+    # is inherited by the extraction worker processes as well
+    os.environ[PROFILING_ENV_VAR] = '1'
+
+
+class PropertyStats:
+    SLOWEST_COUNT = 5
+
+    def __init__(self):
+        self.calls: int = 0
+        self.total_time: float = 0.0
+        # min-heap of (elapsed, dn) holding the slowest calls
+        self.slowest: List[Tuple[float, str]] = []
+
+    def record(self, dn: str, elapsed: float):
+        self.calls += 1
+        self.total_time += elapsed
+        if len(self.slowest) < self.SLOWEST_COUNT:
+            heapq.heappush(self.slowest, (elapsed, dn))
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (elapsed, dn))
+
+    def merge(self, other: 'PropertyStats'):
+        self.calls += other.calls
+        self.total_time += other.total_time
+        for elapsed, dn in other.slowest:
+            if len(self.slowest) < self.SLOWEST_COUNT:
+                heapq.heappush(self.slowest, (elapsed, dn))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, dn))
+
+
+class ExtractionProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, PropertyStats] = {}
+
+    def record(self, prop: str, dn: str, elapsed: float):
+        with self.lock:
+            if prop not in self.stats:
+                self.stats[prop] = PropertyStats()
+            self.stats[prop].record(dn, elapsed)
+
+    def merge(self, stats: Dict[str, PropertyStats]):
+        with self.lock:
+            for prop, prop_stats in stats.items():
+                if prop not in self.stats:
+                    self.stats[prop] = PropertyStats()
+                self.stats[prop].merge(prop_stats)
+
+    def pop_stats(self) -> Dict[str, PropertyStats]:
+        with self.lock:
+            stats = self.stats
+            self.stats = {}
+            return stats
+
+    def report(self) -> str:
+        with self.lock:
+            rows = []
+            for prop, prop_stats in sorted(
+                    self.stats.items(), key=lambda t: t[1].total_time, reverse=True):
+                slowest = sorted(prop_stats.slowest, reverse=True)
+                rows.append({
+                    'property': prop,
+                    'calls': prop_stats.calls,
+                    'total ms': '%.1f' % (prop_stats.total_time * 1000),
+                    'avg us': '%.1f' % (prop_stats.total_time / prop_stats.calls * 1000000),
+                    'slowest': '\n'.join(
+                        '%.1f us %s' % (elapsed * 1000000, dn) for elapsed, dn in slowest),
+                })
+        return tabulate.tabulate(rows, headers='keys', tablefmt='simple')
+
+
+PROFILER = ExtractionProfiler()
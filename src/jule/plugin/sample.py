@@ -1,5 +1,5 @@
 from jule.common import load_text_attr
-from jule.plugin import PluginBase, LdapQuerySet, LdapQuery, ExtractorBase
+from jule.plugin import PluginBase, LdapQuerySet, LdapQuery, ExtractorBase, ScreenQuery
 
 
 class SampleExtractor(ExtractorBase):
@@ -7,17 +7,24 @@ class SampleExtractor(ExtractorBase):
         return [
             'dn',
             'full_name',
+            'manager_dn',
             'manager_name',
             'title',
             'department',
         ]
 
+    def get_referenced_dns(self, dn: str) -> list[str] | None:
+        manager_dn = load_text_attr(self.entry_by_dn[dn], 'manager')
+        return [manager_dn] if manager_dn is not None else []
+
     def extract(self, dn: str, prop: str):
         entry = self.entry_by_dn[dn]
         if prop == 'dn':
             return dn
         elif prop == 'full_name':
             return load_text_attr(entry, 'displayName')
+        elif prop == 'manager_dn':
+            return load_text_attr(entry, 'manager')
         elif prop == 'manager_name':
             manager_dn = load_text_attr(entry, 'manager')
             if manager_dn in self.entry_by_dn:
@@ -46,6 +53,17 @@ class SamplePlugin(PluginBase):
             ], None)
         ]
 
+    @property
+    def snapshot_screen_queries(self) -> list[ScreenQuery]:
+        return super().snapshot_screen_queries + [
+            ScreenQuery('ORG', (
+                'select e.dn, e.full_name, e.title, m.full_name as manager, m.title as manager_title,\n'
+                '  (select count(*) from entries s where s.manager_dn = e.dn) as direct_reports\n'
+                'from entries e\n'
+                'left join entries m on m.dn = e.manager_dn'
+            )),
+        ]
+
     @property
     def version(self):
         return '1.0.0'
@@ -1,63 +1,105 @@
 #! /usr/bin/env python3
 import abc
 import argparse
+import collections
+import concurrent.futures
+import contextlib
 import csv
-import fnmatch
+import functools
+import heapq
+import http.client
+import itertools
 import json
 import logging
-import re
+import os
+import pickle
+import socket
 import sys
-from typing import List, Dict, Optional
+import tempfile
+import threading
+import time
+from typing import List, Dict, Optional, Iterable, Iterator, TextIO, Tuple, Callable
 
 import coloredlogs
-import pandas
-import pandasql
 import tabulate
 
-from jule.common import (
-    Extractor,
-    Property,
+from jule.cache import QueryResultCache, QUERY_RESULTS_CACHE_DIR
+from jule.diff import ADDED, REMOVED, diff_snapshots, iter_changed_dns, raw_diff
+from jule.extract import extract_records, extract_data_frame, iter_records
+from jule.history import HistoryStore, get_history_path
+from jule.name_index import NameIndex
+from jule.plugin import (
+    ExtractorBase,
+    PluginBase,
+    PROFILER,
+    enable_profiling,
+    is_profiling_enabled,
+    load_from_module,
+    get_default_plugin_class_name,
 )
-from jule.state import LdapStorageContainer, LdapSnapshotData
+from jule.sql import SqlSession
+from jule.state import LdapStorageContainer, calculate_snapshot_fingerprint
 
 LOGGER = logging.getLogger(__name__)
 
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+SERVER_ENV_VAR = 'JULE_SERVER'
+SERVER_URL_PREFIX = 'unix:'
+
 
 class BaseFormatter:
-    def format(self, data: List[Dict]):
-        LOGGER.debug('formatting %d entries...', len(data))
-        self.format_impl(data)
+    def format(self, data: Iterable[Dict], out: TextIO) -> int:
+        count = 0
+
+        def counted():
+            nonlocal count
+            for item in data:
+                count += 1
+                yield item
+
+        self.format_impl(counted(), out)
+        LOGGER.debug('formatted %d entries', count)
+        return count
 
     @abc.abstractmethod
-    def format_impl(self, data: List[Dict]):
+    def format_impl(self, data: Iterable[Dict], out: TextIO):
         raise NotImplementedError
 
 
 class TableFormatter(BaseFormatter):
-    def format_impl(self, data: List[Dict]):
-        print(tabulate.tabulate(data, headers='keys', tablefmt='simple'))
+    def format_impl(self, data: Iterable[Dict], out: TextIO):
+        # column widths depend on all the values, so this one is not streamed
+        out.write(tabulate.tabulate(list(data), headers='keys', tablefmt='simple'))
+        out.write('\n')
 
 
 class CsvFormatter(BaseFormatter):
-    def format_impl(self, data: List[Dict]):
-        if not data:
-            return
-        field_names = list(data[0].keys())
-        writer = csv.DictWriter(sys.stdout, fieldnames=field_names, delimiter=',')
-        writer.writeheader()
+    def format_impl(self, data: Iterable[Dict], out: TextIO):
+        writer = None
         for item in data:
+            if writer is None:
+                field_names = list(item.keys())
+                writer = csv.DictWriter(out, fieldnames=field_names, delimiter=',')
+                writer.writeheader()
             writer.writerow(item)
 
 
 class JsonlFormatter(BaseFormatter):
-    def format_impl(self, data: List[Dict]):
+    def format_impl(self, data: Iterable[Dict], out: TextIO):
         for item in data:
-            print(json.dumps(item))
+            out.write(json.dumps(item))
+            out.write('\n')
 
 
 class JsonFormatter(BaseFormatter):
-    def format_impl(self, data: List[Dict]):
-        json.dump(data, fp=sys.stdout)
+    def format_impl(self, data: Iterable[Dict], out: TextIO):
+        out.write('[')
+        for idx, item in enumerate(data):
+            if idx:
+                out.write(', ')
+            out.write(json.dumps(item))
+        out.write(']')
 
 
 FORMATS = {
@@ -68,60 +110,184 @@ FORMATS = {
 }
 
 
-def query_list(snapshot: LdapSnapshotData, properties: Optional[List[str]] = None):
-    properties = properties or [
-        Property.FULL_NAME, Property.TITLE, Property.DEPARTMENT,
-        Property.MANAGER_NAME
-    ]
-    extractor = Extractor(snapshot)
+# properties the hierarchy related queries rely upon, plugin is expected to
+# provide them to make "subordinates" and "root-path" work
+FULL_NAME_PROPERTY = 'full_name'
+MANAGER_DN_PROPERTY = 'manager_dn'
+
+
+def query_list(
+        extractor: ExtractorBase, properties: Optional[List[str]] = None) -> Iterator[Dict]:
+    properties = properties or extractor.get_all_property_names()
+    return iter_records(
+        extractor, sorted(extractor.entry_by_dn.keys()), properties=properties)
+
+
+class QueryContext:
+    """
+    Snapshot along with everything derived from it (extractor, frame loaded
+    into SQL session), which are built lazily once and then shared by all the
+    queries run against the snapshot.
+    """
+
+    def __init__(
+            self, path: str, plugin: PluginBase, cache_dir: str,
+            baseline_provider: Optional[Callable[[str], ExtractorBase]] = None):
+        self.path: str = path
+        self.plugin: PluginBase = plugin
+        self.cache_dir: str = cache_dir
+        self.result_cache = QueryResultCache(os.path.join(cache_dir, QUERY_RESULTS_CACHE_DIR))
+        # seconds spent preparing the data by the phase
+        self.timings: Dict[str, float] = {}
+        self.lock = threading.RLock()
+        self._extractor: Optional[ExtractorBase] = None
+        self._sql_session: Optional[SqlSession] = None
+        self._name_index: Optional[NameIndex] = None
+        # baselines are either shared with other contexts by the provider
+        # (e.g. server context pool) or only the last one used is kept
+        self._baseline_provider = baseline_provider
+        self._baseline: Optional[Tuple[str, ExtractorBase]] = None
+
+    @contextlib.contextmanager
+    def measure(self, phase: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time.perf_counter() - started_at
+
+    def load_extractor(self, path: str) -> ExtractorBase:
+        with self.measure('load'):
+            container = load_snapshot(path)
+            return self.plugin.property_extractor_class(container.data)
+
+    def get_extractor(self) -> ExtractorBase:
+        with self.lock:
+            if self._extractor is None:
+                self._extractor = self.load_extractor(self.path)
+            return self._extractor
+
+    def get_baseline_extractor(self, path: str) -> ExtractorBase:
+        if self._baseline_provider is not None:
+            # not under the lock, so contexts diffed against each other
+            # do not wait for one another
+            return self._baseline_provider(path)
+
+        with self.lock:
+            if self._baseline is None or self._baseline[0] != path:
+                self._baseline = None
+                self._baseline = (path, self.load_extractor(path))
+            return self._baseline[1]
+
+    def get_name_index(self) -> NameIndex:
+        with self.lock:
+            if self._name_index is None:
+                extractor = self.get_extractor()
+                with self.measure('index'):
+                    self._name_index = build_name_index(extractor)
+            return self._name_index
+
+    def get_sql_session(self) -> SqlSession:
+        with self.lock:
+            if self._sql_session is None:
+                extractor = self.get_extractor()
+                with self.measure('extract'):
+                    df = extract_data_frame(extractor)
+                with self.measure('import'):
+                    session = SqlSession()
+                    session.load_table('entries', df, index_columns=self.plugin.indexed_columns)
+                self._sql_session = session
+            return self._sql_session
+
+    def close(self):
+        if self._sql_session is not None:
+            self._sql_session.close()
+
+
+def query_pandas(context: QueryContext, query: str) -> Iterator[Dict]:
+    snapshot_fingerprint = calculate_snapshot_fingerprint(context.path)
+    result_df = context.result_cache.get(snapshot_fingerprint, context.plugin, query)
+    if result_df is None:
+        result_df = context.get_sql_session().query(query)
+        context.result_cache.set(snapshot_fingerprint, context.plugin, query, result_df)
+    else:
+        LOGGER.info('query result is taken from the cache')
+    return iter(result_df.to_dict('records'))
+
+
+def open_history_store(data_dir: str, cache_dir: str, plugin: PluginBase) -> HistoryStore:
+    if not os.path.exists(cache_dir):
+        LOGGER.warning('Cache dir does not exist -> creating')
+        os.makedirs(cache_dir)
+
+    history_store = HistoryStore(get_history_path(cache_dir), plugin)
+    try:
+        history_store.sync(data_dir)
+    except Exception:
+        history_store.close()
+        raise
+    return history_store
+
+
+def query_history(data_dir: str, cache_dir: str, plugin: PluginBase, query: str):
+    open_history_store(data_dir, cache_dir, plugin).close()
 
-    items = []
-    for entry_dn in sorted(extractor.entry_by_dn.keys()):
-        items.append({
-            prop: extractor.extract(entry_dn, prop)
-            for prop in properties
-        })
-    return items
+    with SqlSession(get_history_path(cache_dir)) as session:
+        result_df = session.query(query)
 
+    yield from result_df.to_dict('records')
 
-def query_pandas(snapshot: LdapSnapshotData, query: str):
-    extractor = Extractor(snapshot)
-    data = []
-    for entry_dn in extractor.entry_by_dn:
-        row = dict({
-            str(prop): extractor.extract(entry_dn, prop)
-            for prop in Property
-        }, dn=entry_dn)
-        data.append(row)
 
-    df = pandas.DataFrame.from_records(data)
-    result_df = pandasql.sqldf(query, {
-        'entries': df,
-    })
+def query_entry_history(data_dir: str, cache_dir: str, plugin: PluginBase, pattern: str):
+    history_store = open_history_store(data_dir, cache_dir, plugin)
+    try:
+        records = history_store.lookup(pattern)
+    finally:
+        history_store.close()
+
+    yield from records
 
-    return result_df.to_dict('records')
 
+def build_name_index(extractor: ExtractorBase) -> NameIndex:
+    dns = list(extractor.entry_by_dn)
+    records = extract_records(extractor, dns, properties=[FULL_NAME_PROPERTY])
+    return NameIndex(
+        (entry_dn, record[FULL_NAME_PROPERTY])
+        for entry_dn, record in zip(dns, records)
+    )
 
-def is_glob_match(pattern: str, string: str):
-    string = string or ''
-    regex = fnmatch.translate(pattern)
-    return re.fullmatch(regex, string, flags=re.IGNORECASE)
+
+def find_matching_dns(
+        extractor: ExtractorBase, name_pattern: str,
+        name_index: Optional[NameIndex] = None) -> List[str]:
+    # index is worth building once per snapshot (see QueryContext) when
+    # there are more lookups to come
+    name_index = name_index or build_name_index(extractor)
+    return name_index.match_glob(name_pattern)
+
+
+def get_manager_dn_to_subordinate_dns(extractor: ExtractorBase) -> Dict[str, List[str]]:
+    dns = list(extractor.entry_by_dn)
+    records = extract_records(extractor, dns, properties=[MANAGER_DN_PROPERTY])
+    result = collections.defaultdict(list)
+    for entry_dn, record in zip(dns, records):
+        manager_dn = record[MANAGER_DN_PROPERTY]
+        if manager_dn is not None:
+            result[manager_dn].append(entry_dn)
+    return result
 
 
 # TODO: this module is extremely dependent on specific layout
 #  may be it should be dropped altogether
 
 def query_subordinate_tree(
-        snapshot: LdapSnapshotData, name_pattern: str,
+        extractor: ExtractorBase, name_pattern: str,
         max_distance: Optional[int], min_distance: Optional[int],
-        properties: Optional[List[str]] = None):
-
-    properties = properties or [
-        Property.FULL_NAME, Property.TITLE, Property.DEPARTMENT,
-        Property.MANAGER_NAME
-    ]
+        properties: Optional[List[str]] = None,
+        name_index: Optional[NameIndex] = None) -> Iterator[Dict]:
 
-    extractor = Extractor(snapshot)
+    properties = properties or extractor.get_all_property_names()
+    manager_dn_to_subordinate_dns = get_manager_dn_to_subordinate_dns(extractor)
 
     subordinates = []
 
@@ -133,125 +299,177 @@ def query_subordinate_tree(
             return
 
         subordinates.append((entry_dn, distance))
-        for subordinate_dn in extractor.manager_dn_to_subordinate_dns.get(entry_dn, []):
+        for subordinate_dn in manager_dn_to_subordinate_dns.get(entry_dn, []):
             traverse(subordinate_dn, distance + 1)
 
     # add seed entries
-    for entry_dn, entry in snapshot.entries:
-        full_name = extractor.extract(entry_dn, Property.FULL_NAME)
-        if is_glob_match(name_pattern, full_name):
-            traverse(entry_dn, 0)
-
-    items = []
-    for entry_dn, distance in sorted(subordinates, key=lambda t: (t[1], t[0])):
-        if min_distance is not None and distance < min_distance:
-            continue
-        items.append(dict(distance=distance, **{
-            prop: extractor.extract(entry_dn, prop)
-            for prop in properties
-        }))
-    return items
+    for entry_dn in find_matching_dns(extractor, name_pattern, name_index):
+        traverse(entry_dn, 0)
+
+    subordinates = [
+        (entry_dn, distance)
+        for entry_dn, distance in sorted(subordinates, key=lambda t: (t[1], t[0]))
+        if min_distance is None or distance >= min_distance
+    ]
+    records = iter_records(
+        extractor, [entry_dn for entry_dn, _ in subordinates], properties=properties)
+
+    for (_, distance), record in zip(subordinates, records):
+        yield dict(distance=distance, **record)
 
 
 def query_root_path(
-        snapshot: LdapSnapshotData, name_pattern: str,
-        properties: Optional[List[str]] = None):
-    properties = properties or [
-        Property.FULL_NAME, Property.TITLE, Property.DEPARTMENT,
-        Property.MANAGER_NAME
-    ]
-    extractor = Extractor(snapshot)
+        extractor: ExtractorBase, name_pattern: str,
+        properties: Optional[List[str]] = None,
+        name_index: Optional[NameIndex] = None) -> Iterator[Dict]:
+    properties = properties or extractor.get_all_property_names()
     result = []
 
     def traverse(entry_dn, distance):
         result.append((entry_dn, distance))
-        manager_dn = extractor.extract(entry_dn, Property.MANAGER_DN)
+        manager_dn = extractor.extract(entry_dn, MANAGER_DN_PROPERTY)
         if manager_dn in extractor.entry_by_dn:
             traverse(manager_dn, distance + 1)
 
-    for entry_dn, entry in snapshot.entries:
-        full_name = extractor.extract(entry_dn, Property.FULL_NAME)
-        if is_glob_match(name_pattern, full_name):
-            traverse(entry_dn, 0)
+    for entry_dn in find_matching_dns(extractor, name_pattern, name_index):
+        traverse(entry_dn, 0)
+
+    result = sorted(result, key=lambda t: (t[1], t[0]))
+    records = iter_records(
+        extractor, [entry_dn for entry_dn, _ in result], properties=properties)
 
-    items = []
-    for entry_dn, distance in sorted(result, key=lambda t: (t[1], t[0])):
-        items.append(dict(distance=distance, **{
-            prop: extractor.extract(entry_dn, prop)
-            for prop in properties
-        }))
-    return items
+    for (_, distance), record in zip(result, records):
+        yield dict(distance=distance, **record)
 
 
 def diff(
-        current: LdapSnapshotData, baseline: LdapSnapshotData,
-        properties: Optional[List[str]] = None):
-    properties = properties or [Property.DN, Property.DEPARTMENT, Property.TITLE]
-    current_extractor = Extractor(current)
-    baseline_extractor = Extractor(baseline)
-
-    items = []
-    for entry_dn in current_extractor.entry_by_dn:
-        if entry_dn not in baseline_extractor.entry_by_dn:
-            items.append(dict(diff='added', **{
-                prop: current_extractor.extract(entry_dn, prop)
-                for prop in properties
-            }))
-
-    for entry_dn in baseline_extractor.entry_by_dn:
-        if entry_dn not in current_extractor.entry_by_dn:
-            items.append(dict(diff='removed', **{
-                prop: baseline_extractor.extract(entry_dn, prop)
-                for prop in properties
-            }))
-    return items
-
-
-def order_by(data: List[Dict], properties: List[str]):
-
-    # this wrapper allows to handle for None case as None is not directly
-    # comparable with strings
-    class Wrapper:
-        __slots__ = ['val']
-
-        NULL_VALUES = {
-            str: '',
-            int: 0,
-        }
-        LOGGER = logging.getLogger('comparator')
-
-        def __init__(self, val):
-            self.val = val
-
-        def __lt__(self, other):
-            assert isinstance(other, Wrapper)
-            if self.val is not None and other.val is not None:
-                return self.val < other.val
-            if self.val is None and other.val is None:
-                return False
-            assert self.val is None or other.val is None
-            if self.val is not None:
-                t = type(self.val)
-            else:
-                t = type(other.val)
-            if t in self.NULL_VALUES:
-                self_val = self.val if self.val is not None else self.NULL_VALUES[t]
-                other_val = other.val if other.val is not None else self.NULL_VALUES[t]
-            else:
-                self.LOGGER.warning('unsupported type: %s', t)
-                self_val = str(self.val)
-                other_val = str(other.val)
-            return self_val < other_val
+        current_extractor: ExtractorBase, baseline_extractor: ExtractorBase,
+        properties: Optional[List[str]] = None) -> Iterator[Dict]:
+    properties = properties or current_extractor.get_all_property_names()
+
+    added_dns, removed_dns = [], []
+    for action, entry_dn, _, _ in diff_snapshots(
+            current_extractor.snapshot, baseline_extractor.snapshot):
+        if action == ADDED:
+            added_dns.append(entry_dn)
+        elif action == REMOVED:
+            removed_dns.append(entry_dn)
+
+    for record in iter_records(current_extractor, added_dns, properties=properties):
+        yield dict(diff='added', **record)
+    for record in iter_records(baseline_extractor, removed_dns, properties=properties):
+        yield dict(diff='removed', **record)
+
+
+def diff_raw(
+        current_extractor: ExtractorBase, baseline_extractor: ExtractorBase) -> Iterator[Dict]:
+    changed_dns = iter_changed_dns(current_extractor.snapshot, baseline_extractor.snapshot)
+    yield from raw_diff(
+        current_extractor.entry_by_dn, baseline_extractor.entry_by_dn, changed_dns)
+
+
+# amount of rows sorted in memory at once, longer input is sorted in runs
+# of that size spilled to temporary files which are merged afterwards
+ORDER_BY_RUN_SIZE = 200000
+
+
+@functools.total_ordering
+class Descending:
+    """
+    Inverts the order of the wrapped key; used only for the descending sort
+    keys, so that ascending ones remain plain tuples compared natively.
+    """
+    __slots__ = ['key']
 
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def parse_order_by(specs: List[str]) -> List[Tuple[str, bool]]:
+    """
+    Parses "FIELD[:asc|:desc]" specs into (field, is_descending) pairs.
+    """
+    result = []
+    for spec in specs:
+        field, _, direction = spec.partition(':')
+        direction = direction.lower() or 'asc'
+        if direction not in ('asc', 'desc'):
+            raise Exception('unknown sort direction "%s" for "%s"' % (direction, field))
+        result.append((field, direction == 'desc'))
+    return result
+
+
+def make_sort_key(order: List[Tuple[str, bool]]) -> Callable[[Dict], Tuple]:
     def resolve(item, prop):
         if prop not in item:
             raise Exception('Available keys: %s' % ', '.join(item.keys()))
-        return item[prop]
+        val = item[prop]
+        # values of different types are not comparable, so the key is tagged
+        # with the type: None first, then numbers, strings and the rest
+        # (compared by their text)
+        if val is None:
+            return (0,)
+        elif isinstance(val, (int, float)):
+            return (1, 0, val)
+        elif isinstance(val, str):
+            return (1, 1, val)
+        return (1, 2, str(val))
 
     def get_sort_key(item):
-        return tuple(Wrapper(resolve(item, prop)) for prop in properties)
-
-    return sorted(data, key=get_sort_key)
+        return tuple(
+            Descending(resolve(item, prop)) if is_descending else resolve(item, prop)
+            for prop, is_descending in order
+        )
+
+    return get_sort_key
+
+
+def order_by(
+        data: Iterable[Dict], order: List[Tuple[str, bool]],
+        limit: Optional[int] = None,
+        run_size: int = ORDER_BY_RUN_SIZE) -> Iterator[Dict]:
+    get_sort_key = make_sort_key(order)
+
+    # partial sort keeps only the top rows in the heap
+    if limit is not None:
+        yield from heapq.nsmallest(limit, data, key=get_sort_key)
+        return
+
+    iterator = iter(data)
+    run = list(itertools.islice(iterator, run_size))
+
+    # everything fits into a single run -> plain in-memory sort
+    if len(run) < run_size:
+        yield from sorted(run, key=get_sort_key)
+        return
+
+    def read_run(path: str):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    # external merge sort: sorted runs are spilled to the disk and then merged
+    with tempfile.TemporaryDirectory(prefix='jule-sort-') as tmp_dir:
+        run_paths = []
+        while run:
+            path = os.path.join(tmp_dir, 'run-%d' % len(run_paths))
+            with open(path, 'wb') as f:
+                for item in sorted(run, key=get_sort_key):
+                    pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+            run_paths.append(path)
+            run = list(itertools.islice(iterator, run_size))
+
+        LOGGER.debug('merging %d sorted runs...', len(run_paths))
+        yield from heapq.merge(*[read_run(path) for path in run_paths], key=get_sort_key)
 
 
 def load_snapshot(path: str) -> LdapStorageContainer:
@@ -262,10 +480,236 @@ def load_snapshot(path: str) -> LdapStorageContainer:
         return container
 
 
+def resolve_properties(extractor: ExtractorBase, select: Optional[List[str]]) -> List[str]:
+    all_properties = extractor.get_all_property_names()
+
+    # maintain user order
+    properties = []
+    for prop in select or []:
+        if prop != '*' and prop not in all_properties:
+            raise Exception('unknown property "%s" (known: %s)' % (
+                prop, ', '.join(all_properties)))
+        for prop2 in [prop] if prop != '*' else all_properties:
+            if prop2 not in properties:
+                properties.append(prop2)
+    return properties
+
+
+def get_formatter(format: Optional[str], is_tty: bool) -> BaseFormatter:
+    if not format:
+        LOGGER.warning('output format is not specified')
+        if is_tty:
+            LOGGER.warning('output seems to be TTY, use table format')
+            format = 'table'
+        else:
+            LOGGER.warning('output seems to be not TTY, use jsonl format')
+            format = 'jsonl'
+
+    if format in FORMATS:
+        return FORMATS[format]
+    else:
+        raise Exception('unknown format')
+
+
+def run_query(context: QueryContext, action: str, params: Dict) -> Iterator[Dict]:
+    """
+    Runs the query of given type, params are named the same way as the
+    arguments of the respective subcommand.
+    """
+
+    def get_properties():
+        return resolve_properties(context.get_extractor(), params.get('select'))
+
+    if action == 'list':
+        result = query_list(context.get_extractor(), properties=get_properties())
+    elif action == 'pandasql':
+        result = query_pandas(context, params['query'])
+    elif action == 'history-sql':
+        result = query_history(context.path, context.cache_dir, context.plugin, params['query'])
+    elif action == 'history':
+        result = query_entry_history(context.path, context.cache_dir, context.plugin, params['pattern'])
+    elif action == 'subordinates':
+        result = query_subordinate_tree(
+            context.get_extractor(), params['pattern'],
+            params.get('max_distance'), params.get('min_distance'),
+            properties=get_properties(), name_index=context.get_name_index())
+    elif action == 'root-path':
+        result = query_root_path(
+            context.get_extractor(), params['pattern'], properties=get_properties(),
+            name_index=context.get_name_index())
+    elif action == 'diff' and params.get('raw'):
+        result = diff_raw(
+            context.get_extractor(), context.get_baseline_extractor(params['baseline_path']))
+    elif action == 'diff':
+        result = diff(
+            context.get_extractor(), context.get_baseline_extractor(params['baseline_path']),
+            properties=get_properties())
+    else:
+        raise Exception('unknown query type "%s"' % action)
+
+    # sort and limit if requested
+    if params.get('order_by'):
+        result = order_by(result, parse_order_by(params['order_by']), limit=params.get('limit'))
+    elif params.get('limit') is not None:
+        result = itertools.islice(result, params['limit'])
+
+    return result
+
+
+# query types which are run against a single snapshot (so can be part of the
+# batch or served by the query server)
+SNAPSHOT_QUERY_TYPES = ['list', 'pandasql', 'subordinates', 'root-path', 'diff']
+
+FORMAT_BY_EXTENSION = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'jsonl',
+    '.txt': 'table',
+}
+
+
+def run_batch(context: QueryContext, manifest_path: str, jobs: int = 1) -> bool:
+    """
+    Runs all the queries from the manifest (JSON list of objects with "type",
+    "args", "output" and optional "format") sharing the loaded snapshot,
+    returns False if any of them failed.
+    """
+    with open(manifest_path, 'r', encoding='utf8') as f:
+        manifest = json.load(f)
+
+    for idx, item in enumerate(manifest):
+        if item.get('type') not in SNAPSHOT_QUERY_TYPES:
+            raise Exception('query #%d: unsupported type "%s" (supported: %s)' % (
+                idx, item.get('type'), ', '.join(SNAPSHOT_QUERY_TYPES)))
+        if not item.get('output'):
+            raise Exception('query #%d: output is not specified' % idx)
+
+    def run_item(idx: int, item: Dict) -> Dict:
+        params = {
+            name.replace('-', '_'): value
+            for name, value in (item.get('args') or {}).items()
+        }
+        format = item.get('format') or FORMAT_BY_EXTENSION.get(
+            os.path.splitext(item['output'])[1].lower())
+        started_at = time.perf_counter()
+        status, count = 'ok', None
+        try:
+            formatter = get_formatter(format, is_tty=False)
+            result = run_query(context, item['type'], params)
+            with open(item['output'], 'w', encoding='utf8', newline='',
+                      buffering=OUTPUT_BUFFER_SIZE) as out:
+                count = formatter.format(result, out)
+        except Exception as err:
+            LOGGER.error('query #%d (%s) failed: %s', idx, item['type'], err, exc_info=True)
+            status = 'failed'
+        elapsed = time.perf_counter() - started_at
+        LOGGER.info('query #%d (%s) -> "%s": %s in %.3fs', idx, item['type'], item['output'], status, elapsed)
+        return {
+            '#': idx,
+            'type': item['type'],
+            'output': item['output'],
+            'status': status,
+            'rows': count,
+            'seconds': round(elapsed, 3),
+        }
+
+    LOGGER.info('running %d queries using %d thread(s)...', len(manifest), jobs)
+    started_at = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        timings = list(executor.map(run_item, range(len(manifest)), manifest))
+
+    LOGGER.info('batch finished in %.3fs, data preparation: %s\n%s',
+                time.perf_counter() - started_at,
+                ', '.join('%s %.3fs' % (phase, seconds) for phase, seconds in context.timings.items()),
+                tabulate.tabulate(timings, headers='keys', tablefmt='simple'))
+
+    return all(timing['status'] == 'ok' for timing in timings)
+
+
+class ServerUnavailableError(Exception):
+    pass
+
+
+class NotServableError(Exception):
+    """
+    Query server does not serve the snapshot or plugin (e.g. snapshot is
+    outside of its data dir), so the query is to be run locally.
+    """
+    pass
+
+
+# "code" of the error response for the queries server does not serve
+NOT_SERVABLE_CODE = 'not-servable'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str):
+        super().__init__('localhost')
+        self.socket_path: str = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def query_server(
+        server_url: str, path: str, plugin_module: str,
+        action: str, params: Dict) -> Iterator[Dict]:
+    """
+    Forwards the query to the query server (see jule.server) which keeps
+    the snapshot loaded between the calls, server is addressed by its socket
+    path as "unix:<path>".
+    """
+    if not server_url.startswith(SERVER_URL_PREFIX):
+        raise Exception('server URL is expected to be "%s<socket path>"' % SERVER_URL_PREFIX)
+
+    connection = UnixHTTPConnection(server_url[len(SERVER_URL_PREFIX):])
+    try:
+        connection.request(
+            'POST', '/query',
+            body=json.dumps({
+                'path': path,
+                'plugin_module': plugin_module,
+                'type': action,
+                'args': params,
+            }).encode('utf8'),
+            headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+    except OSError as err:
+        connection.close()
+        raise ServerUnavailableError(str(err)) from err
+
+    with contextlib.closing(connection):
+        if response.status != 200:
+            message = json.load(response)
+            if message.get('code') == NOT_SERVABLE_CODE:
+                raise NotServableError(message.get('error'))
+            raise Exception('server error: %s' % message.get('error'))
+
+        for line in response:
+            message = json.loads(line)
+            if 'row' in message:
+                yield message['row']
+            elif 'error' in message:
+                raise Exception('server error: %s' % message['error'])
+            else:
+                return
+        raise Exception('server response is incomplete')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('path', type=str)
+    parser.add_argument('path', type=str, help='snapshot path (data directory for history-sql and history)')
+    parser.add_argument('--plugin-module', type=str, default=get_default_plugin_class_name())
+    parser.add_argument('--cache-dir', type=str, default='cache')
+    parser.add_argument(
+        '--profile-extraction', action='store_true', default=False,
+        help='report per property extraction stats (same as JULE_PROFILE_EXTRACTION=1)')
+    parser.add_argument(
+        '--server', type=str, default=os.environ.get(SERVER_ENV_VAR),
+        help='query server URL (e.g. unix:jule-server.sock) to forward the query to, '
+             'query runs locally when server is not available (default: $%s)' % SERVER_ENV_VAR)
 
     subparsers = parser.add_subparsers()
 
@@ -273,15 +717,19 @@ if __name__ == '__main__':
         parser_.add_argument('--format', type=str, required=False, choices=FORMATS.keys())
 
     def add_select_argument(parser_):
-        choices = ['*'] + [str(prop.value) for prop in Property]
-        parser_.add_argument('--select', nargs='+', metavar='PROPERTY', choices=choices)
+        parser_.add_argument('--select', nargs='+', metavar='PROPERTY')
 
     def add_order_by_argument(parser_):
-        parser_.add_argument('--order-by', nargs='+', metavar='FIELD')
+        parser_.add_argument(
+            '--order-by', nargs='+', metavar='FIELD[:desc]',
+            help='sort by given fields, append ":desc" for descending order')
+        parser_.add_argument(
+            '--limit', type=int, default=None, required=False,
+            help='output only first N rows (top N when combined with --order-by)')
 
     list_parser = subparsers.add_parser('list')
     list_parser.set_defaults(action='list')
-    list_parser.add_argument('--select', nargs='+', metavar='PROPERTY')
+    add_select_argument(list_parser)
     add_format_argument(list_parser)
     add_order_by_argument(list_parser)
 
@@ -290,6 +738,18 @@ if __name__ == '__main__':
     pandasql_parser.add_argument('--query', type=str, required=True)
     add_format_argument(pandasql_parser)
 
+    history_sql_parser = subparsers.add_parser('history-sql')
+    history_sql_parser.set_defaults(action='history-sql')
+    history_sql_parser.add_argument('--query', type=str, required=True)
+    add_format_argument(history_sql_parser)
+
+    history_parser = subparsers.add_parser(
+        'history', help='changes of the entries DN or name of which matches the pattern')
+    history_parser.set_defaults(action='history')
+    history_parser.add_argument('pattern', type=str)
+    add_format_argument(history_parser)
+    add_order_by_argument(history_parser)
+
     subordinates_parser = subparsers.add_parser('subordinates')
     subordinates_parser.set_defaults(action='subordinates')
     subordinates_parser.add_argument('pattern', type=str)
@@ -309,71 +769,78 @@ if __name__ == '__main__':
     diff_parser = subparsers.add_parser('diff')
     diff_parser.set_defaults(action='diff')
     diff_parser.add_argument('baseline_path', type=str)
+    diff_parser.add_argument(
+        '--raw', action='store_true', default=False,
+        help='compare raw attributes of the common entries (multiple values as sets)')
     add_select_argument(diff_parser)
     add_format_argument(diff_parser)
     add_order_by_argument(diff_parser)
 
+    batch_parser = subparsers.add_parser('batch')
+    batch_parser.set_defaults(action='batch')
+    batch_parser.add_argument(
+        'manifest', type=str,
+        help='JSON list of {"type": ..., "args": {...}, "output": ..., "format": ...}')
+    batch_parser.add_argument(
+        '--jobs', type=int, default=1, help='amount of queries to run in parallel')
+
     args = parser.parse_args()
 
     coloredlogs.install(level=logging.DEBUG, logger=LOGGER)
 
-    def get_properties():
-        # maintain user order
-        properties = []
-        for prop in args.select or []:
-            for prop2 in [prop] if prop != '*' else list(Property):
-                if prop2 not in properties:
-                    properties.append(prop2)
-        return properties
-
-    def get_formatter() -> BaseFormatter:
-        if not args.format:
-            LOGGER.warning('output format is not specified')
-            if sys.stdout.isatty():
-                LOGGER.warning('STDOUT seems to be TTY, use table format')
-                format = 'table'
-            else:
-                LOGGER.warning('STDOUT seems to be not TTY, use jsonl format')
-                format = 'jsonl'
-        else:
-            format = args.format
-
-        if format in FORMATS:
-            return FORMATS[format]
-        else:
-            raise Exception('unknown format')
+    if args.profile_extraction:
+        enable_profiling()
 
     try:
-        container = load_snapshot(args.path)
-        snapshot = container.data
-
-        if args.action == 'list':
-            result = query_list(
-                snapshot, properties=get_properties())
-        elif args.action == 'pandasql':
-            result = query_pandas(
-                snapshot, args.query)
-        elif args.action == 'subordinates':
-            result = query_subordinate_tree(
-                snapshot, args.pattern, args.max_distance, args.min_distance,
-                properties=get_properties())
-        elif args.action == 'root-path':
-            result = query_root_path(
-                snapshot, args.pattern, properties=get_properties())
-        elif args.action == 'diff':
-            baseline_container = load_snapshot(args.baseline_path)
-            baseline = baseline_container.data
-            result = diff(snapshot, baseline, properties=get_properties())
-        else:
-            raise NotImplementedError
+        plugin = load_from_module(args.plugin_module)
+        context = QueryContext(args.path, plugin, args.cache_dir)
 
-        # sort if requested
-        if getattr(args, 'order_by', None):
-            result = order_by(result, args.order_by)
-
-        # format output
-        formatter = get_formatter()
-        formatter.format(result)
+        if args.action == 'batch':
+            succeeded = run_batch(context, args.manifest, jobs=args.jobs)
+        else:
+            result = None
+
+            if args.server and args.action in SNAPSHOT_QUERY_TYPES:
+                params = dict(vars(args))
+                if args.action == 'diff':
+                    params['baseline_path'] = os.path.abspath(args.baseline_path)
+                result = query_server(
+                    args.server, os.path.abspath(args.path), args.plugin_module,
+                    args.action, params)
+                try:
+                    # make sure server is there before committing to it
+                    result = itertools.chain([next(result)], result)
+                except StopIteration:
+                    result = iter([])
+                except ServerUnavailableError as err:
+                    LOGGER.warning('query server is not available (%s) -> run locally', err)
+                    result = None
+                except NotServableError as err:
+                    LOGGER.warning('query server does not serve it (%s) -> run locally', err)
+                    result = None
+
+            if result is None:
+                result = run_query(context, args.action, vars(args))
+
+            # format output, rows are written as they come (unless formatter
+            # needs all of them), so output is buffered generously when piped
+            formatter = get_formatter(args.format, sys.stdout.isatty())
+            output = open(
+                sys.stdout.fileno(), 'w', encoding='utf8', newline='', closefd=False,
+                buffering=1 if sys.stdout.isatty() else OUTPUT_BUFFER_SIZE)
+            try:
+                formatter.format(result, output)
+            finally:
+                output.flush()
+            succeeded = True
+
+        context.close()
+
+        if is_profiling_enabled():
+            LOGGER.info('extraction profile:\n%s', PROFILER.report())
+
+        if not succeeded:
+            sys.exit(1)
     except Exception as err:
         LOGGER.fatal('error! %s', err, exc_info=True)
         sys.exit(1)
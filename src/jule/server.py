@@ -0,0 +1,248 @@
+#! /usr/bin/env python3
+import argparse
+import collections
+import http.server
+import json
+import logging
+import os
+import os.path
+import socketserver
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+import coloredlogs
+
+from jule.plugin import ExtractorBase, PluginBase, get_default_plugin_class_name, load_from_module
+from jule.query import NOT_SERVABLE_CODE, NotServableError, QueryContext, SNAPSHOT_QUERY_TYPES, run_query
+from jule.state import calculate_snapshot_fingerprint
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = 'jule-server.sock'
+DEFAULT_MAX_SNAPSHOTS = 4
+
+
+class ContextPool:
+    """
+    Keeps query contexts (loaded snapshot, extractor and SQL session) of the
+    recently queried snapshots, least recently used ones are dropped once
+    there are more than allowed.
+
+    Only snapshots within the data directory are served and the plugin is
+    the one given on start, as both snapshots and plugins are code to run.
+    """
+
+    def __init__(
+            self, data_dir: str, plugin_module: str, cache_dir: str,
+            max_size: int = DEFAULT_MAX_SNAPSHOTS):
+        self.data_dir: str = os.path.realpath(data_dir)
+        self.plugin_module: str = plugin_module
+        self.plugin: PluginBase = load_from_module(plugin_module)
+        self.cache_dir: str = cache_dir
+        self.max_size: int = max_size
+        self.lock = threading.Lock()
+        self.contexts: Dict[Tuple[str, str], QueryContext] = collections.OrderedDict()
+
+    def resolve_path(self, path: str) -> str:
+        # relative paths are relative to the data dir, absolute ones (and
+        # symlinks) still have to point inside of it
+        resolved_path = os.path.realpath(os.path.join(self.data_dir, path))
+        if os.path.commonpath([resolved_path, self.data_dir]) != self.data_dir:
+            raise NotServableError('path "%s" is outside of the data dir' % path)
+        return resolved_path
+
+    def check_plugin(self, plugin_module: Optional[str]):
+        if plugin_module is not None and plugin_module != self.plugin_module:
+            raise NotServableError('plugin "%s" is not served (server uses "%s")' % (
+                plugin_module, self.plugin_module))
+
+    def get(self, path: str) -> QueryContext:
+        path = self.resolve_path(path)
+
+        # snapshot replaced on disk gets a new context
+        key = (path, calculate_snapshot_fingerprint(path))
+
+        with self.lock:
+            if key in self.contexts:
+                self.contexts.move_to_end(key)
+                return self.contexts[key]
+
+            LOGGER.info('new context for "%s"', path)
+            # baselines are contexts of the pool too, so they are shared and
+            # count towards the limit
+            context = QueryContext(
+                path, self.plugin, self.cache_dir,
+                baseline_provider=self.get_extractor)
+            self.contexts[key] = context
+
+            while len(self.contexts) > self.max_size:
+                # not closed explicitly as other request might be still
+                # using it, it is released once not referenced anymore
+                (evicted_path, _), _ = self.contexts.popitem(last=False)
+                LOGGER.info('dropping context for "%s"', evicted_path)
+
+            return context
+
+    def get_extractor(self, path: str) -> ExtractorBase:
+        return self.get(path).get_extractor()
+
+    def describe(self):
+        with self.lock:
+            return [
+                {'path': path, 'timings': context.timings}
+                for (path, _), context in self.contexts.items()
+            ]
+
+
+class QueryRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    POST /query with {"path", "plugin_module", "type", "args"} JSON body
+    (paths are relative to the data dir, plugin module is optional and has
+    to match the served one) responds with JSON lines: {"row": {...}} per every result row followed
+    by either {"end": <rows count>} or {"error": <message>}.
+    """
+
+    server: 'QueryServer'
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+    def send_json(self, status: int, data):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, {'contexts': self.server.context_pool.describe()})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if request.get('type') not in SNAPSHOT_QUERY_TYPES:
+                raise Exception('unsupported type "%s" (supported: %s)' % (
+                    request.get('type'), ', '.join(SNAPSHOT_QUERY_TYPES)))
+            context_pool = self.server.context_pool
+            context_pool.check_plugin(request.get('plugin_module'))
+            context = context_pool.get(request['path'])
+            params = dict(request.get('args') or {})
+            if params.get('baseline_path') is not None:
+                params['baseline_path'] = context_pool.resolve_path(params['baseline_path'])
+            result = iter(run_query(context, request['type'], params))
+            # errors are mostly raised on the first row, so they can still be
+            # reported with the proper status
+            first_row = next(result, None)
+        except NotServableError as err:
+            # client runs such queries on its own
+            LOGGER.info('not servable: %s', err)
+            self.send_json(403, {'error': str(err), 'code': NOT_SERVABLE_CODE})
+            return
+        except Exception as err:
+            LOGGER.warning('request failed: %s', err, exc_info=True)
+            self.send_json(400, {'error': str(err)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        count = 0
+        try:
+            if first_row is not None:
+                self.write_line({'row': first_row})
+                count += 1
+                for row in result:
+                    self.write_line({'row': row})
+                    count += 1
+            self.write_line({'end': count})
+        except BrokenPipeError:
+            LOGGER.warning('client went away')
+        except Exception as err:
+            LOGGER.warning('request failed: %s', err, exc_info=True)
+            self.write_line({'error': str(err)})
+
+    def write_line(self, data):
+        self.wfile.write(json.dumps(data, default=str).encode('utf8'))
+        self.wfile.write(b'\n')
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Listens on the Unix socket only the user running the server can connect
+    to (requests are not authenticated otherwise).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, context_pool: ContextPool):
+        self.context_pool: ContextPool = context_pool
+
+        # left behind by the server which was not stopped properly
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        # socket is created with the permissions already restricted, so
+        # there is no moment anyone else can connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, QueryRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='serves query.py requests keeping recently used snapshots in memory')
+    parser.add_argument('--data-dir', type=str, required=True, help='only snapshots within it are served')
+    parser.add_argument('--plugin-module', type=str, default=get_default_plugin_class_name())
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET_PATH, help='Unix socket path')
+    parser.add_argument('--cache-dir', type=str, default='cache')
+    parser.add_argument(
+        '--max-snapshots', type=int, default=DEFAULT_MAX_SNAPSHOTS,
+        help='amount of snapshots kept loaded')
+
+    args = parser.parse_args()
+
+    coloredlogs.install(level=logging.DEBUG, logger=LOGGER)
+
+    if not os.path.isdir(args.data_dir):
+        raise Exception('data dir "%s" does not exist' % args.data_dir)
+
+    context_pool = ContextPool(
+        args.data_dir, args.plugin_module, os.path.abspath(args.cache_dir),
+        max_size=args.max_snapshots)
+    socket_path = os.path.abspath(args.socket)
+    server = QueryServer(socket_path, context_pool)
+    LOGGER.info('listening on unix:%s (serving "%s" using %s)',
+                socket_path, context_pool.data_dir, args.plugin_module)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        LOGGER.info('stopping...')
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        LOGGER.fatal('error! %s', err, exc_info=True)
+        sys.exit(1)
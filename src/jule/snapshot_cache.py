@@ -0,0 +1,95 @@
+import collections
+import logging
+import os
+import os.path
+import threading
+from typing import Dict, Tuple
+
+from jule.plugin import ExtractorBase
+from jule.state import try_load
+
+LOGGER = logging.getLogger(__name__)
+
+# loaded snapshot takes roughly that many times more memory than its
+# compressed file, which is used to estimate the footprint without measuring
+MEMORY_PER_FILE_BYTE = 10
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def get_default_max_bytes() -> int:
+    return int(os.environ.get('JULE_SNAPSHOT_CACHE_BYTES') or DEFAULT_MAX_BYTES)
+
+
+class SnapshotCache:
+    """
+    Keeps extractors (along with the snapshots they wrap) of the recently
+    used snapshot files, so that snapshot participating in several diffs is
+    loaded only once. Least recently used ones are dropped once estimated
+    memory footprint exceeds the budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.lock = threading.Lock()
+        self.items: Dict[Tuple, Tuple[ExtractorBase, int]] = collections.OrderedDict()
+        self.loading_locks: Dict[Tuple, threading.Lock] = {}
+        self.total_bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_extractor(self, path: str, extractor_class: type[ExtractorBase]) -> ExtractorBase:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        # rewritten file is loaded again
+        key = (path, stat.st_size, stat.st_mtime_ns, extractor_class)
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            # concurrent requests of the same snapshot wait for the single
+            # load, while other snapshots are served (and loaded) meanwhile
+            key_lock = self.loading_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                with self.lock:
+                    if key in self.items:
+                        self.items.move_to_end(key)
+                        self.hits += 1
+                        return self.items[key][0]
+                    self.misses += 1
+
+                container = try_load(path, load_data=True)
+
+                if container is None:
+                    raise Exception('unable to load "%s"' % path)
+
+                extractor = extractor_class(container.data)
+                size = stat.st_size * MEMORY_PER_FILE_BYTE
+
+                with self.lock:
+                    self.items[key] = (extractor, size)
+                    self.total_bytes += size
+
+                    # the one just loaded is kept regardless of the budget
+                    while self.total_bytes > self.max_bytes and len(self.items) > 1:
+                        (evicted_path, *_), (_, evicted_size) = self.items.popitem(last=False)
+                        self.total_bytes -= evicted_size
+                        LOGGER.debug('dropping "%s" from the snapshot cache', evicted_path)
+
+                return extractor
+            finally:
+                with self.lock:
+                    if self.loading_locks.get(key) is key_lock:
+                        del self.loading_locks[key]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.total_bytes = 0
+
+
+SNAPSHOT_CACHE = SnapshotCache(get_default_max_bytes())
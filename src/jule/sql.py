@@ -0,0 +1,78 @@
+import logging
+import sqlite3
+import threading
+from typing import Optional, List
+
+import pandas
+
+LOGGER = logging.getLogger(__name__)
+
+
+class QueryError(Exception):
+    pass
+
+
+class SqlSession:
+    """
+    Holds SQLite database with the loaded frames for the lifetime of the
+    session, so that every new query runs against already populated tables
+    instead of importing the whole frame again.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path: str = path
+        # connection is populated in the worker thread and queried from the
+        # UI thread, access is serialized with the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.set_read_only(True)
+
+    def set_read_only(self, read_only: bool):
+        # prevents user queries from tampering with the loaded tables
+        self.connection.execute('PRAGMA query_only = %s' % ('ON' if read_only else 'OFF'))
+
+    def load_table(
+            self, name: str, data_frame: pandas.DataFrame,
+            index_columns: Optional[List[str]] = None):
+        LOGGER.debug('loading %d rows into "%s" table...', len(data_frame), name)
+        with self.lock:
+            self.set_read_only(False)
+            try:
+                data_frame.to_sql(name, self.connection, index=False, if_exists='replace')
+                for column in index_columns or []:
+                    if column not in data_frame.columns:
+                        continue
+                    LOGGER.debug('creating index on "%s.%s"...', name, column)
+                    self.connection.execute('CREATE INDEX "ix_%s_%s" ON "%s" ("%s")' % (
+                        name, column, name, column))
+                # let the query planner know the data distribution
+                self.connection.execute('ANALYZE "%s"' % name)
+            finally:
+                self.set_read_only(True)
+
+    def query(self, query: str) -> pandas.DataFrame:
+        with self.lock:
+            try:
+                return pandas.read_sql_query(query, self.connection)
+            except (sqlite3.Error, pandas.errors.DatabaseError) as err:
+                raise QueryError(str(err)) from err
+
+    def explain(self, query: str) -> str:
+        plan = self.query('EXPLAIN QUERY PLAN ' + query)
+        depth_by_id = {0: -1}
+        lines = []
+        for node_id, parent_id, detail in zip(plan['id'], plan['parent'], plan['detail']):
+            depth = depth_by_id.get(parent_id, -1) + 1
+            depth_by_id[node_id] = depth
+            lines.append('  ' * depth + detail)
+        return '\n'.join(lines)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
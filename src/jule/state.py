@@ -1,11 +1,14 @@
 import gzip
+import hashlib
 import io
 import logging
+import os
 import pickle
 import tarfile
+import threading
 import time
 import typing
-from typing import BinaryIO, Optional
+from typing import BinaryIO, Optional, Dict, Tuple
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,9 +26,48 @@ class SerializableBase(typing.Generic[T]):
         return obj
 
 
+def calculate_entry_digest(entry: dict) -> bytes:
+    """
+    Digest of the canonicalized entry attributes: neither order of the
+    attributes nor order of the values of multivalued ones matter.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for attr in sorted(entry):
+        values = entry[attr]
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        encoded_values = sorted(
+            value if isinstance(value, bytes) else str(value).encode('utf8')
+            for value in values
+        )
+        hasher.update(attr.encode('utf8'))
+        hasher.update(len(encoded_values).to_bytes(4, 'little'))
+        for value in encoded_values:
+            hasher.update(len(value).to_bytes(4, 'little'))
+            hasher.update(value)
+    return hasher.digest()
+
+
 class LdapSnapshotData(SerializableBase['LdapSnapshotData']):
-    def __init__(self, entries: list[tuple[str, dict]]):
+    # whether entries are ordered by DN (snapshots saved before that was
+    # introduced get the class level default)
+    sorted_by_dn: bool = False
+
+    # digests of the entries by DN, stored along with the entries, but
+    # calculated on demand for the snapshots saved before
+    entry_digests: Optional[Dict[str, bytes]] = None
+
+    def __init__(self, entries: list[tuple[str, dict]], sorted_by_dn: bool = False):
         self.entries: list[tuple[str, dict]] = entries
+        self.sorted_by_dn = sorted_by_dn
+
+    def get_entry_digests(self) -> Dict[str, bytes]:
+        if self.entry_digests is None:
+            self.entry_digests = {
+                entry_dn: calculate_entry_digest(entry)
+                for entry_dn, entry in self.entries
+            }
+        return self.entry_digests
 
 
 class LdapSnapshotMetadata(SerializableBase['LdapSnapshotMetadata']):
@@ -35,6 +77,10 @@ class LdapSnapshotMetadata(SerializableBase['LdapSnapshotMetadata']):
         self.entries_count: Optional[int] = entries_count
         self.parameters: Optional[dict] = parameters
 
+    # digest of the serialized data set on save (absent for the snapshots
+    # saved before it was introduced)
+    data_digest: Optional[str] = None
+
 
 class LdapStorageContainer:
     # 1 - fastest, 9 - smallest (speed difference is negligible in our cases
@@ -49,27 +95,41 @@ class LdapStorageContainer:
         if self.data is None:
             raise Exception('trying to save w/o data')
 
+        # entries are stored ordered by DN, so that snapshots can be diffed
+        # with a merge of two sorted streams
+        if not self.data.sorted_by_dn:
+            self.data = LdapSnapshotData(
+                sorted(self.data.entries, key=lambda t: t[0]), sorted_by_dn=True)
+
+        self.data.get_entry_digests()
+
+        def serialize(obj) -> bytes:
+            with io.BytesIO() as buffer:
+                obj.save(buffer)
+                return buffer.getvalue()
+
+        data_bytes = serialize(self.data)
+        # lets caches recognize the snapshot by the content, no matter what
+        # the file is called or when it was written
+        self.metadata.data_digest = hashlib.sha256(data_bytes).hexdigest()
+
         LOGGER.info('saving container...')
         with tarfile.open(mode='w', fileobj=f) as tar:
             layout = {
-                'data.bin.gz': self.data,
-                'metadata.bin.gz': self.metadata,
+                'data.bin.gz': data_bytes,
+                'metadata.bin.gz': serialize(self.metadata),
             }
-            for name, obj in layout.items():
-                with io.BytesIO() as buffer:
-                    obj.save(buffer)
-                    buffer.seek(0)
-                    raw_bytes = buffer.read()
-                    compressed_bytes = gzip.compress(
-                        raw_bytes, compresslevel=self.COMPRESS_LEVEL)
-                    with io.BytesIO(compressed_bytes) as compressed_buffer:
-                        compressed_buffer_size = compressed_buffer.getbuffer().nbytes
-                        tar_info = tarfile.TarInfo(name)
-                        tar_info.size = compressed_buffer_size
-                        tar.addfile(
-                            tar_info,
-                            fileobj=compressed_buffer
-                        )
+            for name, raw_bytes in layout.items():
+                compressed_bytes = gzip.compress(
+                    raw_bytes, compresslevel=self.COMPRESS_LEVEL)
+                with io.BytesIO(compressed_bytes) as compressed_buffer:
+                    compressed_buffer_size = compressed_buffer.getbuffer().nbytes
+                    tar_info = tarfile.TarInfo(name)
+                    tar_info.size = compressed_buffer_size
+                    tar.addfile(
+                        tar_info,
+                        fileobj=compressed_buffer
+                    )
 
     @staticmethod
     def load(f: BinaryIO, load_data: bool = True) -> 'LdapStorageContainer':
@@ -95,3 +155,43 @@ def try_load(path: str, load_data: bool = False) -> Optional[LdapStorageContaine
             return LdapStorageContainer.load(f, load_data=load_data)
     except Exception:
         return None
+
+
+# amount of bytes from the file start hashed into the fingerprint of the
+# snapshots which do not have data digest stored
+FINGERPRINT_HEAD_SIZE = 64 * 1024
+
+_fingerprint_lock = threading.Lock()
+_fingerprint_by_file_state: Dict[Tuple[str, int, int], str] = {}
+
+
+def calculate_snapshot_fingerprint(path: str) -> str:
+    """
+    Cheap identity of the snapshot content: data digest stored in the
+    metadata (which survives renames and copies), or for the older snapshots
+    size, modification time and hash of the file head. Result is memoized for
+    as long as file size and modification time stay the same.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    file_state = (path, stat.st_size, stat.st_mtime_ns)
+
+    with _fingerprint_lock:
+        if file_state in _fingerprint_by_file_state:
+            return _fingerprint_by_file_state[file_state]
+
+    container = try_load(path, load_data=False)
+
+    if container is not None and container.metadata.data_digest:
+        fingerprint = 'data:' + container.metadata.data_digest
+    else:
+        hasher = hashlib.sha256()
+        hasher.update(b'%d:%d:' % (stat.st_size, stat.st_mtime_ns))
+        with open(path, 'rb') as f:
+            hasher.update(f.read(FINGERPRINT_HEAD_SIZE))
+        fingerprint = 'file:' + hasher.hexdigest()
+
+    with _fingerprint_lock:
+        _fingerprint_by_file_state[file_state] = fingerprint
+
+    return fingerprint